@@ -0,0 +1,93 @@
+"""
+Compare formatting of author lists as BibTeX of papnt.prop2entry with the
+former implementation (reference_prop2entry.py), on a synthetic corpus
+which includes large-collaboration papers with hundreds of authors.
+
+    python benchmarks/bench_authors.py
+    python benchmarks/bench_authors.py --records 5000 --max-authors 3000
+"""
+import argparse
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+import reference_prop2entry
+from fakeservers import FAMILIES, GIVENS
+from papnt import prop2entry
+
+PARTICLES = ('de', 'de la', 'van', 'van der', 'von', 'von dem', 'du', 'di',
+             "l'", 'zu', 'el', 'da')
+MIDDLES = ('J.', 'R.', 'M. K.', 'Maria', 'Jr')
+
+
+def make_name(rng: random.Random) -> str:
+    given = rng.choice(GIVENS)
+    family = rng.choice(FAMILIES)
+    match rng.random():
+        case r if r < .15:
+            family = f'{rng.choice(PARTICLES)} {family}'
+        case r if r < .25:
+            given = f'{given} {rng.choice(MIDDLES)}'
+        case r if r < .30:  # Only family name, as NotionPropMaker keeps it
+            return family.replace(' ', '_')
+        case r if r < .33:
+            return f'{given} {rng.choice(PARTICLES)} {rng.choice(PARTICLES)}'\
+                   f' {family}'
+    return f'{given} {family}'
+
+
+def make_corpus(n_records: int, max_authors: int, seed: int=0
+                ) -> list:
+    """Author lists of records; 2% of them are of large collaborations."""
+    rng = random.Random(seed)
+    names = [make_name(rng) for _ in range(max(n_records, 2000))]
+    corpus = []
+    for _ in range(n_records):
+        if rng.random() < .02:
+            n_authors = rng.randint(max_authors // 10, max_authors)
+        else:
+            n_authors = rng.randint(1, 12)
+        corpus.append([{'name': rng.choice(names)}
+                       for _ in range(n_authors)])
+    return corpus
+
+
+def run(func, corpus: list) -> tuple:
+    start = time.perf_counter()
+    results = [func(authors) for authors in corpus]
+    return time.perf_counter() - start, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--records', type=int, default=5000)
+    parser.add_argument('--max-authors', type=int, default=1000)
+    args = parser.parse_args()
+
+    corpus = make_corpus(args.records, args.max_authors)
+    n_authors = sum(len(authors) for authors in corpus)
+    print(f'{args.records} records, {n_authors} authors')
+
+    seconds_ref, expected = run(
+        reference_prop2entry._extr_authors_asbib, corpus)
+    prop2entry._format_author.cache_clear()
+    seconds_cold, results = run(prop2entry._extr_authors_asbib, corpus)
+    seconds_warm, _ = run(prop2entry._extr_authors_asbib, corpus)
+    n_different = sum(result != expected_ for result, expected_
+                      in zip(results, expected))
+    if n_different:
+        raise AssertionError(f'{n_different} author lists differ')
+
+    print(f'{"":<12}{"total [s]":>10}{"per author [us]":>17}{"speedup":>9}')
+    for name, seconds in (('former', seconds_ref), ('new (cold)', seconds_cold),
+                          ('new (warm)', seconds_warm)):
+        print(f'{name:<12}{seconds:>10.3f}{seconds / n_authors * 1e6:>17.2f}'
+              f'{seconds_ref / seconds:>8.1f}x')
+
+
+if __name__ == '__main__':
+    main()
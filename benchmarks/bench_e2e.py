@@ -0,0 +1,306 @@
+"""
+End-to-end benchmark of papnt commands against local stand-ins for Notion,
+Crossref/JaLC and GROBID (see fakeservers.py). Nothing is sent to the
+real services.
+
+Each command runs through papnt.cli in a fresh process on a synthetic
+database, and its wall time, peak memory (max RSS) and requests received by
+the fake servers are reported. makebib is run with --all on records tagged
+with several targets. `remakebib` times makebib run again on unchanged
+records, and `mirrorbib` times makebib --mirror, which first downloads all
+records to the empty local mirror.
+
+    python benchmarks/bench_e2e.py
+    python benchmarks/bench_e2e.py --commands doi makebib --sizes 100 1000
+    python benchmarks/bench_e2e.py --notion-latency 0.2 --notion-rps 3 \\
+        --rate-limit-every 20 --sizes 100
+
+Notion is not throttled by default (--notion-rps 1000) so that the time
+spent in papnt itself is measured; pass --notion-rps 3 to see the time
+imposed by the rate limit of Notion.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from fakeservers import (JOURNALS, FakeCrossref, FakeGrobid, FakeNotion,
+                         _to_response_prop, crossref_message, text_prop)
+from teidata import make_tei
+
+from papnt.misc import load_config
+
+COMMANDS = ('doi', 'jalc', 'paths', 'pdf', 'makebib', 'remakebib',
+            'mirrorbib')
+TARGET = 'bench'
+N_SUBTARGETS = 3  # Other tags, to make several BIB files by makebib --all
+PROPTYPES = {
+    'doi': 'rich_text', 'author': 'multi_select', 'title': 'rich_text',
+    'edition': 'rich_text', 'year': 'number', 'journal': 'select',
+    'volume': 'rich_text', 'pages': 'rich_text', 'publisher': 'select',
+    'id': 'rich_text', 'entrytype': 'select', 'howpublished': 'rich_text',
+    'output_target': 'multi_select', 'pdf': 'files'}
+EMPTY = {'title': [], 'rich_text': [], 'multi_select': [], 'select': None,
+         'number': None, 'files': [], 'checkbox': False}
+
+config = load_config(Path(__file__).parents[1] / 'papnt' / 'config.ini')
+propnames = config['propnames']
+
+
+def _doi(i: int) -> str:
+    return f'10.5555/bench.{i}'
+
+
+def _schema() -> dict:
+    schema = {propnames[key]: proptype for key, proptype in PROPTYPES.items()}
+    return schema | {'Name': 'title', 'info': 'checkbox', 'First': 'select',
+                     'Issue': 'rich_text', 'Subject': 'multi_select'}
+
+
+def make_page(i: int, properties: dict) -> dict:
+    page = {'object': 'page', 'id': f'00000000-0000-0000-0000-{i:012d}',
+            'created_time': '2024-01-01T00:00:00.000Z',
+            'last_edited_time': '2024-01-01T00:00:00.000Z',
+            'properties': {name: {'type': proptype, proptype: EMPTY[proptype]}
+                           for name, proptype in _schema().items()}}
+    page['properties'] |= properties
+    return page
+
+
+def make_pages(command: str, n_records: int, files_url: str) -> list:
+    from papnt.cache import MetadataCache
+    from papnt.notionprop import NotionPropMaker
+    prop_maker = NotionPropMaker(cache=MetadataCache(':memory:'))
+    pages = []
+    for i in range(n_records):
+        match command:
+            case 'doi' | 'jalc':
+                properties = {'DOI': text_prop(_doi(i))}
+            case 'pdf':
+                properties = {propnames['pdf']: {'type': 'files', 'files': [
+                    {'name': f'{i}.pdf', 'type': 'file',
+                     'file': {'url': f'{files_url}/files/{i}.pdf'}}]}}
+            case 'makebib' | 'remakebib' | 'mirrorbib':
+                properties = prop_maker._make_properties(
+                    crossref_message(_doi(i)), propnames)
+                properties = {key: _to_response_prop(value)
+                              for key, value in properties.items()}
+                properties |= {
+                    'info': {'type': 'checkbox', 'checkbox': True},
+                    propnames['output_target']: {
+                        'type': 'multi_select',
+                        'multi_select': [
+                            {'name': TARGET},
+                            {'name': f'{TARGET}-{i % N_SUBTARGETS}'}]}}
+            case 'paths':
+                continue
+        pages.append(make_page(i, properties))
+    return pages
+
+
+def make_pdfs(dir_pdf: Path, n_records: int):
+    """PDFs printing their DOI on page one, as publishers do."""
+    import pymupdf
+    dir_pdf.mkdir(parents=True, exist_ok=True)
+    for i in range(n_records):
+        if (dir_pdf / f'{i}.pdf').exists():
+            continue
+        doc = pymupdf.open()
+        doc.new_page().insert_text(
+            (72, 72), f'Synthetic paper {i}\nhttps://doi.org/{_doi(i)}')
+        doc.save(dir_pdf / f'{i}.pdf')
+        doc.close()
+
+
+def _max_rss_mb() -> float:
+    # ru_maxrss survives exec on Linux and may be of the parent process.
+    status = Path('/proc/self/status')
+    if status.exists():
+        for line in status.read_text().splitlines():
+            if line.startswith('VmHWM:'):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_child(spec: dict) -> dict:
+    """
+    Run one command by papnt.cli in this process, pointed to the fake
+    servers. Environment set by run_benchmark gives the database and puts
+    caches, local mirror and BIB files in the working directory.
+    """
+    from notion_client import Client
+
+    import papnt.cli as cli
+    from papnt import mainfunc, notionprop
+    from papnt.abbrlister import AbbrCache
+    from papnt.cache import default_cache_dir
+    from papnt.pdf2text import PDF2ChildrenConverter
+
+    if not spec['verbose']:
+        logging.getLogger('httpx').setLevel(logging.WARNING)
+    notionprop.CROSSREF_API = spec['crossref']
+    notionprop.JALC_API = spec['crossref']
+    mainfunc._converter = PDF2ChildrenConverter(spec['grobid'])
+    cli.config['notion']['requests_per_second'] = spec['notion_rps']
+    get_database = cli._get_database
+    def _get_database():
+        database = get_database()
+        database.notion = Client(auth='secret_bench', base_url=spec['notion'])
+        return database
+    cli._get_database = _get_database
+    if not spec['abbr']:  # ISO 4 needs WordNet of nltk, so they are cached
+        AbbrCache(default_cache_dir() / 'abbr.sqlite').set_many(
+            {name: name for name in JOURNALS})
+
+    dir_bib = Path(spec['dir_bib'])
+    dir_bib.mkdir(exist_ok=True)
+    match spec['command']:
+        case 'paths':
+            args = ['paths', spec['dir_pdf']]
+        case 'makebib' | 'remakebib':
+            args = ['makebib', '--all']
+        case 'mirrorbib':
+            args = ['makebib', '--all', '--mirror']
+        case command:
+            args = [command]
+    if spec['command'] == 'remakebib':
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli.main(args, standalone_mode=False)
+    rss_before = _max_rss_mb()
+    start = time.perf_counter()
+    stdout = sys.stderr if spec['verbose'] else io.StringIO()
+    with contextlib.redirect_stdout(stdout):
+        cli.main(args, standalone_mode=False)
+    seconds = time.perf_counter() - start
+    n_result = None
+    if spec['command'] in ('makebib', 'remakebib', 'mirrorbib'):
+        n_result = sum(
+            line.startswith('@') for line in (dir_bib / f'{TARGET}.bib')
+            .read_text(encoding='UTF-8').splitlines())
+    return {'seconds': seconds, 'rss_before_mb': rss_before,
+            'peak_rss_mb': _max_rss_mb(), 'n_result': n_result}
+
+
+def run_benchmark(command: str, n_records: int, servers: dict,
+                  workdir: Path, args: argparse.Namespace) -> dict:
+    notion, crossref, grobid = (servers[key]
+                                for key in ('notion', 'crossref', 'grobid'))
+    dir_pdf = workdir / f'pdfs-{n_records}'
+    if command in ('paths', 'pdf'):
+        make_pdfs(dir_pdf, n_records)
+    files = {f'{i}.pdf': dir_pdf / f'{i}.pdf' for i in range(n_records)}
+    notion.load(make_pages(command, n_records, notion.url),
+                files if command == 'pdf' else None)
+    for server in servers.values():
+        server.reset_counts()
+
+    with tempfile.TemporaryDirectory(dir=workdir) as dir_run:
+        spec = {'command': command, 'dir_bib': f'{dir_run}/bib',
+                'dir_pdf': str(dir_pdf), 'notion': notion.url,
+                'crossref': crossref.url, 'grobid': grobid.url,
+                'notion_rps': args.notion_rps, 'verbose': args.verbose,
+                'abbr': args.abbr}
+        # Caches and local mirror are made under the temporary home
+        env = os.environ | {
+            'HOME': dir_run, 'TOKEN_KEY': 'secret_bench',
+            'DATABASE_ID': 'bench', 'DIR_SAVE_BIB': spec['dir_bib'],
+            'PYTHONWARNINGS': 'ignore'}
+        process = subprocess.run(
+            [sys.executable, __file__, '--child', json.dumps(spec)],
+            stdout=subprocess.PIPE, text=True, env=env)
+    if process.returncode != 0:
+        raise RuntimeError(f'{command} ({n_records} records) failed')
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+
+    counts = notion.counts + crossref.counts + grobid.counts
+    if result['n_result'] is None:
+        if command == 'paths':
+            result['n_result'] = len(notion.pages)
+        else:
+            result['n_result'] = sum(
+                page['properties']['info']['checkbox']
+                for page in notion.pages.values())
+    return {'command': command, 'n_records': n_records, **result,
+            'requests': dict(counts)}
+
+
+def print_row(result: dict):
+    requests = result['requests']
+    n_notion = sum(n for key, n in requests.items()
+                   if key.startswith('notion') and key != 'notion 429')
+    n_crossref = sum(requests.get(key, 0)
+                     for key in ('crossref', 'crossref batch', 'jalc'))
+    print(f'{result["command"]:<9}{result["n_records"]:>8}'
+          f'{result["seconds"]:>10.2f}{result["peak_rss_mb"]:>10.1f}'
+          f'{n_notion:>8}{requests.get("notion 429", 0):>6}{n_crossref:>10}'
+          f'{requests.get("grobid", 0):>8}'
+          f'{requests.get("file download", 0):>7}{result["n_result"]:>7}',
+          flush=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument('--commands', nargs='+', choices=COMMANDS,
+                        default=['doi', 'paths', 'pdf', 'makebib',
+                                 'mirrorbib'])
+    parser.add_argument('--sizes', nargs='+', type=int,
+                        default=[100, 1000, 10000])
+    parser.add_argument('--notion-latency', type=float, default=0.,
+                        help='Seconds taken by each Notion request')
+    parser.add_argument('--notion-rps', type=float, default=1000.,
+                        help='requests_per_second given to NotionTransport')
+    parser.add_argument('--rate-limit-every', type=int, default=0,
+                        help='Answer every n-th Notion request by 429')
+    parser.add_argument('--crossref-latency', type=float, default=0.)
+    parser.add_argument('--grobid-latency', type=float, default=0.)
+    parser.add_argument('--abbr', action='store_true',
+                        help='Abbreviate journals by ISO 4 in makebib, '
+                             'instead of taking them from cache '
+                             '(needs WordNet of nltk)')
+    parser.add_argument('--json', help='Save results to this JSON file')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Show outputs of papnt')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_child(json.loads(args.child))
+        print(json.dumps(result))
+        return
+
+    servers = {
+        'notion': FakeNotion(args.notion_latency, args.rate_limit_every),
+        'crossref': FakeCrossref(args.crossref_latency),
+        'grobid': FakeGrobid(make_tei(n_paragraphs=40, n_bibs=20, n_figs=2,
+                                      n_tabs=1), args.grobid_latency)}
+    print(f'{"command":<9}{"records":>8}{"wall [s]":>10}{"RSS [MB]":>10}'
+          f'{"notion":>8}{"429":>6}{"crossref":>10}{"grobid":>8}'
+          f'{"files":>7}{"done":>7}')
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for n_records in args.sizes:
+            for command in args.commands:
+                result = run_benchmark(command, n_records, servers,
+                                       Path(workdir), args)
+                print_row(result)
+                results.append(result)
+    for server in servers.values():
+        server.close()
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
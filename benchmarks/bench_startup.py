@@ -0,0 +1,81 @@
+"""
+Startup time of papnt CLI: `papnt --help`, and `papnt doi` on a database
+without unchecked records (a fake Notion, see fakeservers.py).
+
+Times are wall times of the whole process, best of --repeat runs, and
+compared with the targets below. `python -c pass` is shown as the floor.
+
+    python benchmarks/bench_startup.py
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+from fakeservers import FakeNotion
+
+TARGETS = {'papnt --help': .3, 'papnt doi (empty)': .6}
+
+DOI_WITH_FAKE_NOTION = '''
+import sys
+import papnt.cli as cli
+
+url = sys.argv[1]
+get_database = cli._get_database
+def _get_database():
+    from notion_client import Client
+    database = get_database()
+    database.notion = Client(auth='secret_bench', base_url=url)
+    return database
+cli._get_database = _get_database
+sys.argv[1:] = ['doi']
+cli.main()
+'''
+
+
+def best_of(command: list, env: dict, n_repeat: int) -> float:
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=env, check=True,
+                       stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    notion = FakeNotion()
+    with tempfile.TemporaryDirectory() as home:
+        # Local mirror etc. are made under the temporary home
+        env = os.environ | {
+            'HOME': home, 'TOKEN_KEY': 'secret_bench',
+            'DATABASE_ID': 'bench', 'PYTHONWARNINGS': 'ignore',
+            'PYTHONPATH': str(Path(__file__).parents[1])}
+        commands = {
+            'python -c pass': [sys.executable, '-c', 'pass'],
+            'papnt --help': [sys.executable, '-c',
+                             'from papnt.cli import main; main()', '--help'],
+            'papnt doi (empty)': [sys.executable, '-c', DOI_WITH_FAKE_NOTION,
+                                  notion.url]}
+        print(f'{"command":<22}{"time [s]":>10}{"target [s]":>12}')
+        for name, command in commands.items():
+            seconds = best_of(command, env, args.repeat)
+            target = TARGETS.get(name)
+            verdict = '' if target is None else \
+                f'{target:>12.2f}  {"ok" if seconds <= target else "SLOW"}'
+            print(f'{name:<22}{seconds:>10.3f}{verdict}')
+    notion.close()
+
+
+if __name__ == '__main__':
+    main()
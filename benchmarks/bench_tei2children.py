@@ -0,0 +1,96 @@
+"""
+Compare TEI-to-blocks conversion of papnt.pdf2text (lxml) with the
+former BeautifulSoup implementation.
+
+Outputs are compared on the documents without <figure>, because the former
+implementation did not place figures and tables next to their references.
+Text and DOI links of the blocks are compared (see texts_and_links).
+
+    python benchmarks/bench_tei2children.py
+    python benchmarks/bench_tei2children.py --tei paper1.tei.xml paper2.tei.xml
+"""
+import argparse
+import html
+import re
+import sys
+import time
+from pathlib import Path
+from urllib.parse import unquote
+
+sys.path.insert(0, str(Path(__file__).parent))
+sys.path.insert(0, str(Path(__file__).parents[1]))
+
+import reference_pdf2text_bs4
+from papnt.pdf2text import tei2children
+from teidata import make_tei
+
+
+def best_of(func, xmltext: str, n_repeat: int) -> float:
+    times = []
+    for _ in range(n_repeat):
+        start = time.perf_counter()
+        func(xmltext)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def remove_figures(xmltext: str) -> str:
+    return re.sub(r'<figure\b.*?</figure>', '', xmltext, flags=re.DOTALL)
+
+
+def texts_and_links(children: list) -> list:
+    """
+    Text (without markup) and DOI links of each block. Other differences
+    are deliberate: the former implementation linked references without
+    DOI to their target like '#b0', left 'type="bibr">' in the text of
+    references without target, kept escaped markup in paragraphs citing
+    them, and did not quote DOIs in links. It also lost '<' and '&' of
+    paragraphs citing SICI DOIs (with '<' and '>') by parsing them again.
+    """
+    summary = []
+    for child in children:
+        if 'paragraph' not in child:
+            summary.append(child)
+            continue
+        texts = [text['text'] for text in child['paragraph']['rich_text']]
+        content = ''.join(text['content'] for text in texts)
+        content = html.unescape(re.sub(r'<[^>]*>|type="bibr">', '', content))
+        content = re.sub(r'[<&]', '', content)
+        links = [unquote(html.unescape(text['link']['url']))
+                 for text in texts if 'link' in text
+                 and text['link']['url'].startswith('http')]
+        summary.append((content, links))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--tei', nargs='*', default=[],
+                        help='TEI files returned by GROBID')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    documents = {path: Path(path).read_text() for path in args.tei}
+    if not documents:
+        documents = {
+            f'synthetic ({n} paragraphs)': make_tei(
+                n_paragraphs=n, n_bibs=n // 3, n_figs=n // 50,
+                n_tabs=n // 100)
+            for n in (50, 400, 1600)}
+
+    print(f'{"document":<32}{"bs4 [s]":>10}{"lxml [s]":>10}{"speedup":>9}'
+          f'{"same":>6}')
+    for name, xmltext in documents.items():
+        without_figures = remove_figures(xmltext)
+        same = texts_and_links(
+            reference_pdf2text_bs4.tei2children(without_figures)) == \
+            texts_and_links(tei2children(without_figures))
+        time_bs4 = best_of(
+            reference_pdf2text_bs4.tei2children, xmltext, args.repeat)
+        time_lxml = best_of(tei2children, xmltext, args.repeat)
+        print(f'{name:<32}{time_bs4:>10.4f}{time_lxml:>10.4f}'
+              f'{time_bs4 / time_lxml:>8.1f}x{str(same):>6}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,308 @@
+"""
+Local stand-ins for Notion API, Crossref/JaLC and GROBID.
+
+Each server counts the requests it receives by route, so benchmarks can
+report how many requests a command sent.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlparse
+
+from papnt.mirror import match_filter
+
+JOURNALS = ('Journal of Neuroscience', 'Nature Human Behaviour',
+            'Proceedings of the National Academy of Sciences',
+            'Cerebral Cortex', 'NeuroImage', 'PLOS ONE', 'eLife',
+            'Journal of Experimental Psychology: General',
+            'Psychological Science', 'Neuron', 'Cognition',
+            'Trends in Cognitive Sciences', 'Nature Communications')
+GIVENS = ('Taro', 'Hanako', 'John', 'Maria', 'Wei', 'Anna', 'Pierre',
+          'Ludwig', 'Sofia', 'Kenji')
+FAMILIES = ('Yamada', 'Suzuki', 'Smith', 'Garcia', 'Wang', 'van der Berg',
+            'de la Cruz', 'Müller', "O'Neil", 'von Neumann', 'Tanaka')
+WORDS = ('neural response task model effect signal cortex memory attention '
+         'learning reward stimulus the of and in a').split()
+
+Route = Tuple[str, str, Callable]
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec='milliseconds')
+
+
+class FakeServer:
+    def __init__(self, routes: List[Route], latency: float=0.):
+        """
+        routes: list of (method, regex of path, handler). A handler receives
+        (match, query, body) and returns (status, headers, body).
+        """
+        self.routes = [(method, re.compile(pattern), handler)
+                       for method, pattern, handler in routes]
+        self.latency = latency
+        self.counts = Counter()
+        self._lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self.httpd.daemon_threads = True
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}'
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def count(self, key: str):
+        with self._lock:
+            self.counts[key] += 1
+
+    def reset_counts(self):
+        with self._lock:
+            self.counts.clear()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                for method, pattern, handler in server.routes:
+                    if method != self.command:
+                        continue
+                    if (match := pattern.fullmatch(unquote(url.path))):
+                        break
+                else:
+                    server.count(f'{self.command} (unknown)')
+                    return self._send(404, {}, b'{}')
+                if server.latency:
+                    time.sleep(server.latency)
+                self._send(*handler(match, parse_qs(url.query), body))
+
+            def _send(self, status: int, headers: dict, body: bytes | str):
+                if isinstance(body, str):
+                    body = body.encode()
+                self.send_response(status)
+                headers = {'Content-Type': 'application/json'} | headers
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PATCH = _dispatch
+
+        return Handler
+
+
+def _to_response_prop(value: dict, proptype: Optional[str]=None) -> dict:
+    """Property value sent to Notion, as Notion returns it."""
+    proptype = proptype or next(key for key in value if key != 'type')
+    content = value[proptype]
+    if proptype in ('title', 'rich_text'):
+        content = [{'type': 'text',
+                    'text': {'content': text['text']['content'],
+                             'link': text['text'].get('link')},
+                    'plain_text': text['text']['content']}
+                   for text in content]
+    return {'type': proptype, proptype: content}
+
+
+def text_prop(text: str, proptype: str='rich_text') -> dict:
+    return _to_response_prop({proptype: [{'text': {'content': text}}]})
+
+
+class FakeNotion(FakeServer):
+    def __init__(self, latency: float=0., rate_limit_every: int=0,
+                 retry_after: float=.05):
+        """
+        rate_limit_every: int
+            Answer every n-th request by 429 (Too Many Requests) with
+            Retry-After of retry_after seconds. 0 disables it.
+        """
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.pages: Dict[str, dict] = {}
+        self.files: Dict[str, Path] = {}
+        self.n_requests = 0
+        super().__init__([
+            ('POST', r'/v1/databases/([^/]+)/query', self._query),
+            ('POST', r'/v1/pages', self._create),
+            ('PATCH', r'/v1/pages/([^/]+)', self._update),
+            ('PATCH', r'/v1/blocks/([^/]+)/children', self._append),
+            ('GET', r'/files/(.+)', self._file)], latency)
+
+    def load(self, pages: List[dict], files: Optional[Dict[str, Path]]=None):
+        with self._lock:
+            self.pages = {page['id']: page for page in pages}
+            self.files = files or {}
+
+    def _limited(self) -> bool:
+        with self._lock:
+            self.n_requests += 1
+            return (self.rate_limit_every > 0 and
+                    self.n_requests % self.rate_limit_every == 0)
+
+    def _rate_limited_response(self):
+        self.count('notion 429')
+        return 429, {'Retry-After': str(self.retry_after)}, json.dumps(
+            {'object': 'error', 'status': 429, 'code': 'rate_limited',
+             'message': 'Rate limited'})
+
+    def _query(self, match, query, body):
+        if self._limited():
+            return self._rate_limited_response()
+        self.count('notion query')
+        body = json.loads(body or b'{}')
+        size = int(body.get('page_size') or 100)
+        # Cursor is ID of the next page, so records edited while paginating
+        # are neither skipped nor returned twice.
+        with self._lock:
+            ids = list(self.pages)
+            start = ids.index(body['start_cursor']) \
+                if body.get('start_cursor') else 0
+            results = []
+            for id_ in ids[start:]:
+                if match_filter(self.pages[id_], body.get('filter')):
+                    results.append(self.pages[id_])
+                    if len(results) > size:
+                        break
+            results = json.loads(json.dumps(results))
+        has_more = len(results) > size
+        return 200, {}, json.dumps({
+            'object': 'list', 'results': results[:size],
+            'has_more': has_more,
+            'next_cursor': results[-1]['id'] if has_more else None})
+
+    def _create(self, match, query, body):
+        if self._limited():
+            return self._rate_limited_response()
+        self.count('notion create')
+        properties = json.loads(body)['properties']
+        page = {'object': 'page', 'id': str(uuid.uuid4()),
+                'created_time': _now(), 'last_edited_time': _now(),
+                'properties': {key: _to_response_prop(value)
+                               for key, value in properties.items()}}
+        with self._lock:
+            self.pages[page['id']] = page
+        return 200, {}, json.dumps(page)
+
+    def _update(self, match, query, body):
+        if self._limited():
+            return self._rate_limited_response()
+        self.count('notion update')
+        properties = json.loads(body).get('properties', {})
+        with self._lock:
+            page = self.pages[match.group(1)]
+            for key, value in properties.items():
+                proptype = page['properties'].get(key, {}).get('type')
+                page['properties'][key] = _to_response_prop(value, proptype)
+            page['last_edited_time'] = _now()
+        return 200, {}, json.dumps(page)
+
+    def _append(self, match, query, body):
+        if self._limited():
+            return self._rate_limited_response()
+        self.count('notion append')
+        children = json.loads(body)['children']
+        return 200, {}, json.dumps({
+            'object': 'list', 'results': [
+                {'object': 'block', 'id': str(uuid.uuid4()),
+                 'type': child.get('type')} for child in children]})
+
+    def _file(self, match, query, body):
+        self.count('file download')
+        path = self.files.get(match.group(1))
+        if path is None:
+            return 404, {}, b''
+        return 200, {'Content-Type': 'application/pdf'}, path.read_bytes()
+
+
+def crossref_message(doi: str) -> dict:
+    """Synthetic Crossref metadata, always the same for the same DOI."""
+    rng = random.Random(doi)
+    authors = [{'given': rng.choice(GIVENS), 'family': rng.choice(FAMILIES)}
+               for _ in range(rng.randint(1, 12))]
+    first_page = rng.randint(1, 2000)
+    return {
+        'DOI': doi, 'type': 'journal-article',
+        'title': [' '.join(rng.choice(WORDS) for _ in range(10)).title()],
+        'author': authors,
+        'published': {'date-parts': [[rng.randint(1950, 2025), 1, 1]]},
+        'container-title': [rng.choice(JOURNALS)],
+        'volume': str(rng.randint(1, 120)), 'issue': str(rng.randint(1, 12)),
+        'page': f'{first_page}-{first_page + rng.randint(5, 30)}',
+        'publisher': 'Synthetic Press'}
+
+
+def jalc_data(doi: str) -> dict:
+    message = crossref_message(doi)
+    return {
+        'doi': doi, 'article_type': 'pub',
+        'title_list': [{'lang': 'en', 'title': message['title'][0]}],
+        'creator_list': [
+            {'names': [{'lang': 'en', 'first_name': author['family'],
+                        'last_name': author['given']}]}
+            for author in message['author']],
+        'date': f'{message["published"]["date-parts"][0][0]}-01-01',
+        'journal_title_name_list': [
+            {'lang': 'en', 'type': 'full',
+             'journal_title_name': message['container-title'][0]}],
+        'publisher_list': [{'lang': 'en', 'publisher_name': 'Synthetic'}],
+        'volume': message['volume'], 'first_page': '1', 'last_page': '9'}
+
+
+class FakeCrossref(FakeServer):
+    def __init__(self, latency: float=0.):
+        """Crossref REST API (/works) and JaLC API (/dois) in one server."""
+        super().__init__([
+            ('GET', r'/works', self._works),
+            ('GET', r'/works/(.+)', self._work),
+            ('GET', r'/dois/(.+)', self._jalc)], latency)
+
+    def _works(self, match, query, body):
+        self.count('crossref batch')
+        dois = [doi.removeprefix('doi:')
+                for doi in query.get('filter', [''])[0].split(',') if doi]
+        return 200, {}, json.dumps({'message': {
+            'items': [crossref_message(doi) for doi in dois]}})
+
+    def _work(self, match, query, body):
+        self.count('crossref')
+        return 200, {}, json.dumps(
+            {'message': crossref_message(match.group(1))})
+
+    def _jalc(self, match, query, body):
+        self.count('jalc')
+        return 200, {}, json.dumps({'data': jalc_data(match.group(1))})
+
+
+class FakeGrobid(FakeServer):
+    def __init__(self, tei: str, latency: float=0.):
+        """GROBID which returns the same TEI for any PDF."""
+        self.tei = tei
+        super().__init__([
+            ('GET', r'/api/isalive', self._isalive),
+            ('POST', r'/api/processFulltextDocument', self._fulltext)],
+            latency)
+
+    def _isalive(self, match, query, body):
+        return 200, {'Content-Type': 'text/plain'}, 'true'
+
+    def _fulltext(self, match, query, body):
+        self.count('grobid')
+        return 200, {'Content-Type': 'application/xml'}, self.tei
@@ -0,0 +1,47 @@
+"""
+Author formatting of papnt.prop2entry as it was before the particles were
+matched by precompiled patterns. Kept only as the baseline of
+bench_authors.py.
+"""
+from typing import List, Dict
+import re
+
+
+def _extr_authors_asbib(authors: List[Dict] | None) -> str:
+    def extr_lastname(name: str):
+        PREPOSITIONS = [
+            "da", "de", "degli", "del", "della", "des", "de la", "de las",
+            "de los", "el", "di", "du", "la", "le", "l'", "van", "van de",
+            "van den", "van der", "von", "von dem", "von der", "zu",
+            "zu der", 
+        ]
+        prepositions_ = [prepo.replace(' ', '_') for prepo in PREPOSITIONS]
+
+        for preposition in PREPOSITIONS:
+            before = ' ' + preposition + ' '
+            after = ' ' + preposition.replace(' ', '_') + ' '
+            name = re.sub(r'\b' + re.escape(before) + r'\b', after, name)
+
+        preposition = ''
+        for preposit_ in prepositions_:
+            preposit_ = ' ' + preposit_ + ' '
+            match = re.search(preposit_, name)
+            if match:
+                preposition = match.group(0).replace('_', ' ')[1:]  # remove head space
+        return preposition + name.split()[-1]
+
+    if authors is None:
+        return ''
+    names = []
+    for author in authors:
+        name = author['name']
+        lastname = extr_lastname(name)
+        firstnames = name.replace(lastname, '').rstrip()
+        lastname = lastname.replace('_', ' ')
+        if ' ' in lastname:
+            lastname = '{' + lastname + '}'
+        if firstnames:
+            names.append(f'{lastname}, {firstnames}')
+        else:
+            names.append(lastname)
+    return ' and '.join(names)
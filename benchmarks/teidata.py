@@ -0,0 +1,98 @@
+"""Synthetic TEI documents shaped like GROBID processFulltextDocument output."""
+import random
+from xml.sax.saxutils import escape
+
+WORDS = ('neural response task participants model effect signal cortex data '
+         'analysis trial memory attention learning reward condition stimulus '
+         'the of and in to with for on by a an de van der').split()
+
+
+def _sentence(rng: random.Random, n_words: int) -> str:
+    return escape(' '.join(rng.choice(WORDS) for _ in range(n_words)))
+
+
+def _paragraph(rng: random.Random, n_bibs: int, n_figs: int, n_tabs: int
+               ) -> str:
+    pieces = []
+    for _ in range(rng.randint(3, 8)):
+        pieces.append(_sentence(rng, rng.randint(8, 25)))
+        roll = rng.random()
+        if roll < .35 and n_bibs:
+            i = rng.randrange(n_bibs + 2)  # some refer to missing entries
+            pieces.append(f'<ref type="bibr" target="#b{i}">[{i + 1}]</ref>')
+        elif roll < .40:
+            pieces.append('<ref type="bibr">(Unresolved et al., 2001)</ref>')
+        elif roll < .50 and n_figs:
+            i = rng.randrange(n_figs)
+            pieces.append(f'<ref type="figure" target="#fig_{i}">Fig. '
+                          f'{i + 1}</ref>')
+        elif roll < .55 and n_tabs:
+            i = rng.randrange(n_tabs)
+            pieces.append(f'<ref type="table" target="#tab_{i}">Table '
+                          f'{i + 1}</ref>')
+        elif roll < .60:
+            pieces.append('<hi rend="italic">p</hi> &lt; 0.05 &amp; '
+                          '"quoted" it\'s')
+        elif roll < .63:
+            pieces.append('<formula xml:id="formula_0">x = y</formula>')
+    return f'<p>{" ".join(pieces)}</p>'
+
+
+def make_tei(n_paragraphs: int=400, n_bibs: int=150, n_figs: int=8,
+             n_tabs: int=4, n_rows: int=12, seed: int=0) -> str:
+    rng = random.Random(seed)
+    body = []
+    for i_section in range(max(1, n_paragraphs // 8)):
+        paragraphs = ''.join(_paragraph(rng, n_bibs, n_figs, n_tabs)
+                             for _ in range(8))
+        body.append('<div xmlns="http://www.tei-c.org/ns/1.0">'
+                    f'<head n="{i_section + 1}.">{_sentence(rng, 3)}</head>'
+                    f'{paragraphs}</div>')
+    for i in range(n_figs):
+        body.append(
+            f'<figure xml:id="fig_{i}"><head>Fig. {i + 1}.</head>'
+            f'<label>{i + 1}</label><figDesc>Fig. {i + 1}. '
+            f'{_sentence(rng, 30)}</figDesc><graphic url="x.png"/></figure>')
+    for i in range(n_tabs):
+        rows = ''.join(
+            '<row>' + ''.join(f'<cell>{rng.randint(0, 99)}</cell>'
+                              for _ in range(4)) + '</row>'
+            for _ in range(n_rows))
+        body.append(
+            f'<figure type="table" xml:id="tab_{i}"><head>Table {i + 1}'
+            f'</head><label>{i + 1}</label><figDesc>{_sentence(rng, 20)}'
+            f'</figDesc><table>{rows}</table></figure>')
+
+    bibs = []
+    for i in range(n_bibs):
+        if i % 5 == 0:
+            idno = ''
+        elif i % 17 == 0:
+            idno = ('<idno type="DOI">10.1002/(SICI)1097-4571(199806)49:8'
+                    '&lt;693::AID-ASI4&gt;3.0.CO;2-0</idno>')
+        else:
+            idno = f'<idno type="DOI">10.1000/j.{i}</idno>'
+        bibs.append(
+            f'<biblStruct xml:id="b{i}"><analytic><title>'
+            f'{_sentence(rng, 6)}</title></analytic><monogr><title>Journal'
+            f'</title><imprint><date when="2020"/></imprint></monogr>{idno}'
+            '</biblStruct>')
+
+    abstract = ('<div xmlns="http://www.tei-c.org/ns/1.0">'
+                f'{_paragraph(rng, n_bibs, 0, 0)}</div>')
+    acknowledgement = ('<div type="acknowledgement">'
+                       '<div xmlns="http://www.tei-c.org/ns/1.0">'
+                       f'<head>Acknowledgements</head><p>{_sentence(rng, 20)}'
+                       '</p></div></div>')
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<TEI xml:space="preserve" xmlns="http://www.tei-c.org/ns/1.0" '
+        'xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+        'xmlns:xlink="http://www.w3.org/1999/xlink">\n'
+        '<teiHeader xml:lang="en"><fileDesc><titleStmt><title level="a" '
+        'type="main">Synthetic paper</title></titleStmt></fileDesc>'
+        f'<profileDesc><abstract>{abstract}</abstract></profileDesc>'
+        '</teiHeader>\n'
+        f'<text xml:lang="en"><body>{"".join(body)}</body>'
+        f'<back>{acknowledgement}<div type="references"><listBibl>'
+        f'{"".join(bibs)}</listBibl></div></back></text></TEI>\n')
@@ -1,27 +1,142 @@
 import json
+import os
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import version
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
 
 from bibtexparser import loads
 from bibtexparser.bparser import BibTexParser
-from iso4 import abbreviate
-import nltk
+
+from .cache import default_cache_dir
+
+# A worker process takes ~0.2 sec to import iso4 and load LTWA, while one
+# name takes ~25 msec, so few names are abbreviated in this process.
+MIN_NAMES_PER_WORKER = 8
+SQL_CHUNKSIZE = 500  # Number of names in one SELECT
+
+_wordnet_is_ready = False
 
 
 def _remove_duplicated_space(dict_: dict):
     return {k: v.replace('  ', ' ') for k, v in dict_.items()}
 
 
+def _names_journal(entries: List[dict]) -> List[str]:
+    names_journal = [entry.get('journal') for entry in entries]
+    return sorted(list(set(
+        [name for name in names_journal if name is not None])))
+
+
+def _prepare_wordnet():
+    """Look for WordNet data used by iso4 offline, and download if missing."""
+    global _wordnet_is_ready
+    if _wordnet_is_ready:
+        return
+    import nltk
+    try:
+        nltk.data.find('corpora/wordnet')
+    except LookupError:
+        nltk.download('wordnet', quiet=True)
+    _wordnet_is_ready = True
+
+
+def _abbreviate(name: str) -> str:
+    from iso4 import abbreviate
+    return abbreviate(name)
+
+
+def abbreviate_many(names: List[str], n_workers: Optional[int]=None
+                    ) -> Dict[str, str]:
+    """Abbreviate journal names by ISO 4, in parallel over CPU cores."""
+    if not names:
+        return {}
+    _prepare_wordnet()
+    n_workers = min(n_workers or os.cpu_count() or 1,
+                    len(names) // MIN_NAMES_PER_WORKER)
+    if n_workers <= 1:
+        return {name: _abbreviate(name) for name in names}
+    chunksize = -(-len(names) // (n_workers * 4))
+    with ProcessPoolExecutor(n_workers) as executor:
+        return dict(zip(names, executor.map(_abbreviate, names,
+                                            chunksize=chunksize)))
+
+
+class AbbrCache:
+    def __init__(self, path_db: str | Path, iso4_version: Optional[str]=None):
+        """
+        Abbreviations of journal names by ISO 4, keyed by full name.
+        They are valid while iso4 (and LTWA data in it) is the same version,
+        and those by other versions are deleted.
+
+        iso4_version: str
+            Version of iso4 which abbreviates. Default is the installed one.
+        """
+        Path(path_db).parent.mkdir(parents=True, exist_ok=True)
+        self.iso4_version = iso4_version or version('iso4')
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path_db), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS abbrs ('
+                'name TEXT PRIMARY KEY, abbr TEXT, iso4_version TEXT)')
+            self._conn.execute('DELETE FROM abbrs WHERE iso4_version != ?',
+                               (self.iso4_version,))
+
+    def get_many(self, names: List[str]) -> Dict[str, str]:
+        abbrs = {}
+        with self._lock:
+            for i in range(0, len(names), SQL_CHUNKSIZE):
+                chunk = names[i:i + SQL_CHUNKSIZE]
+                abbrs |= dict(self._conn.execute(
+                    'SELECT name, abbr FROM abbrs WHERE name IN '
+                    f'({", ".join("?" * len(chunk))})', chunk).fetchall())
+        return abbrs
+
+    def set_many(self, abbrs: Dict[str, str]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO abbrs VALUES (?, ?, ?)',
+                [(name, abbr, self.iso4_version)
+                 for name, abbr in abbrs.items()])
+
+
+_default_abbr_cache = None
+_default_abbr_cache_lock = threading.Lock()
+
+
+def get_abbr_cache() -> AbbrCache:
+    global _default_abbr_cache
+    with _default_abbr_cache_lock:
+        if _default_abbr_cache is None:
+            _default_abbr_cache = AbbrCache(default_cache_dir() / 'abbr.sqlite')
+    return _default_abbr_cache
+
+
 class AbbrLister:
-    def __init__(self, path_bib: str):
+    def __init__(self, path_bib: str, cache: Optional[AbbrCache]=None):
+        """
+        cache: AbbrCache
+            Abbreviations made before. Journals not in it are abbreviated
+            and added to it. Default is in the cache directory of papnt.
+        """
         with open(path_bib, 'r') as f:
             bibtext = f.read()
         parser = BibTexParser()
         bibdatabase = loads(bibtext, parser).entries_dict
-        names_journal = [article.get('journal')
-                         for article in bibdatabase.values()]
-        self.names_journal = sorted(list(set(
-            [name for name in names_journal if name is not None])))
+        self.names_journal = _names_journal(list(bibdatabase.values()))
+        self.cache = cache
 
-        nltk.download('wordnet')
+    @classmethod
+    def from_journals(cls, names_journal: Iterable[str],
+                      cache: Optional[AbbrCache]=None):
+        """From journal names in hand, instead of reading BIB file."""
+        lister = cls.__new__(cls)
+        lister.names_journal = sorted(set(names_journal))
+        lister.cache = cache
+        return lister
 
     def listup(self, spec: dict | None=None):
         """
@@ -30,7 +145,13 @@ class AbbrLister:
             {'PLOS ONE': 'PLOS ONE'}
             Case insensitive.
         """
-        abbrs = {name: abbreviate(name) for name in self.names_journal}
+        cache = self.cache or get_abbr_cache()
+        abbrs = cache.get_many(self.names_journal)
+        new_abbrs = abbreviate_many(
+            [name for name in self.names_journal if name not in abbrs])
+        cache.set_many(new_abbrs)
+        abbrs = abbrs | new_abbrs
+        abbrs = {name: abbrs[name] for name in self.names_journal}
         self.abbrs = _remove_duplicated_space(abbrs)
         if spec is None:
             return self
@@ -44,11 +165,15 @@ class AbbrLister:
         if not hasattr(self, 'abbrs'):
             raise ValueError('Use listup() first.')
 
+        abbrjson = json.dumps(
+            {'default': {'container-title': self.abbrs}}, indent=2)
+        if Path(save_path).is_file() and \
+                Path(save_path).read_text() == abbrjson:
+            return  # Not to touch the file watched by LaTeX tools etc.
         with open(save_path, 'w') as f:
-            json.dump(
-                {'default': {'container-title': self.abbrs}}, f, indent=2)
+            f.write(abbrjson)
 
 
 if __name__ == '__main__':
     lister = AbbrLister('/Users/issakuss/Desktop/study14.bib')
-    lister.listup().save('/Users/issakuss/Desktop/study14.json')
\ No newline at end of file
+    lister.listup().save('/Users/issakuss/Desktop/study14.json')
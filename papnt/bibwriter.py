@@ -0,0 +1,195 @@
+import filecmp
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from tempfile import TemporaryFile
+from typing import IO, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+# Rendered entries kept in memory by each BIB file before they are sorted
+# and moved to a temporary file.
+MAX_BYTES_IN_MEMORY = 1 << 22
+
+# Bump when entry_to_bibtex or notionprop_to_entry changes their output.
+ENTRY_FORMAT_VERSION = 1
+# last_edited_time of Notion is rounded down to minutes, so an entry rendered
+# in the same minute as the last edit may miss a later edit in that minute.
+MIN_SECONDS_AFTER_EDIT = 120
+
+Item = Tuple[str, int, str]  # (sort key, order of addition, BibTeX)
+CachedEntry = Tuple[str, Optional[str], str]  # (citekey, journal, BibTeX)
+
+
+def entry_to_bibtex(entry: dict) -> str:
+    """Entry as BibTeX, formatted as BibTexWriter of bibtexparser does."""
+    fields = ''.join(f',\n {field} = {{{entry[field]}}}'
+                     for field in sorted(entry)
+                     if field not in ('ENTRYTYPE', 'ID'))
+    return f'@{entry["ENTRYTYPE"]}{{{entry["ID"]}{fields}\n}}\n'
+
+
+def _to_timestamp(notion_time: str) -> float:
+    return datetime.fromisoformat(notion_time.replace('Z', '+00:00')).timestamp()
+
+
+class EntryCache:
+    def __init__(self, path_db: str | Path, database_id: str,
+                 propnames: dict):
+        """
+        Rendered BibTeX entries of pages, valid while last_edited_time of
+        the page and propnames are the same as when rendered. Entries by
+        other propnames or versions are deleted when opened, and entries of
+        pages deleted from the database by prune().
+        """
+        Path(path_db).parent.mkdir(parents=True, exist_ok=True)
+        self.database_id = database_id
+        self.format_key = hashlib.sha256(json.dumps(
+            [ENTRY_FORMAT_VERSION, propnames], sort_keys=True).encode()
+            ).hexdigest()[:16]
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path_db), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'database_id TEXT, page_id TEXT, last_edited_time TEXT, '
+                'format_key TEXT, rendered_at REAL, '
+                'citekey TEXT, journal TEXT, bibtex TEXT, '
+                'PRIMARY KEY (database_id, page_id))')
+            self._conn.execute(
+                'DELETE FROM entries WHERE database_id = ? AND format_key != ?',
+                (self.database_id, self.format_key))
+
+    def get_many(self, pages: List[dict]) -> Dict[str, CachedEntry]:
+        """Cached entries of pages not edited since rendered, by page ID."""
+        edited_times = {page['id']: page['last_edited_time']
+                        for page in pages}
+        page_ids = list(edited_times)
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT page_id, last_edited_time, rendered_at, '
+                'citekey, journal, bibtex FROM entries '
+                'WHERE database_id = ? AND format_key = ? AND page_id IN '
+                f'({", ".join("?" * len(page_ids))})',
+                (self.database_id, self.format_key, *page_ids)).fetchall()
+        return {
+            page_id: (citekey, journal, bibtex)
+            for page_id, edited_time, rendered_at, citekey, journal, bibtex
+            in rows if edited_time == edited_times[page_id] and
+            rendered_at - _to_timestamp(edited_time) >= MIN_SECONDS_AFTER_EDIT}
+
+    def set_many(self, entries: Dict[str, Tuple[str, CachedEntry]]):
+        """entries: {page ID: (last_edited_time, (citekey, journal, BibTeX))}"""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                [(self.database_id, page_id, edited_time, self.format_key, now,
+                  *entry) for page_id, (edited_time, entry) in entries.items()])
+
+    def prune(self, page_ids: Iterable[str]):
+        """Delete entries of pages other than page_ids, all pages in use."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TEMP TABLE IF NOT EXISTS pages_in_use ('
+                'page_id TEXT PRIMARY KEY)')
+            self._conn.execute('DELETE FROM pages_in_use')
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO pages_in_use VALUES (?)',
+                [(page_id,) for page_id in page_ids])
+            self._conn.execute(
+                'DELETE FROM entries WHERE database_id = ? AND page_id NOT IN '
+                '(SELECT page_id FROM pages_in_use)', (self.database_id,))
+            self._conn.execute('DELETE FROM pages_in_use')
+
+
+def _iter_run(run: IO) -> Iterator[Item]:
+    run.seek(0)
+    for line in run:
+        yield tuple(json.loads(line))
+
+
+class BibFileWriter:
+    def __init__(self, path_bib: str | Path,
+                 max_bytes_in_memory: int=MAX_BYTES_IN_MEMORY):
+        """
+        Write entries to BIB file sorted by citekey (case insensitive) as
+        BibTexWriter does, without keeping all of them in memory: sorted
+        runs of entries are moved to temporary files and merged at close().
+        The file is written under a temporary name and renamed, so that
+        readers never see it half-written. It is not replaced if the content
+        is the same, so that tools watching it are not triggered.
+        """
+        self.path_bib = Path(path_bib)
+        self.max_bytes_in_memory = max_bytes_in_memory
+        self.n_entries = 0
+        self.n_bytes = 0
+        self.is_changed = False
+        self.journals: Set[str] = set()
+        self._items: List[Item] = []
+        self._n_bytes_in_memory = 0
+        self._runs: List[IO] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def add(self, entry: dict):
+        self.add_bibtex(entry['ID'], entry_to_bibtex(entry),
+                        entry.get('journal'))
+
+    def add_bibtex(self, citekey: str, bibtex: str,
+                   journal: Optional[str]=None):
+        """Add entry rendered by entry_to_bibtex()."""
+        self._items.append((str(citekey).lower(), self.n_entries, bibtex))
+        self.n_entries += 1
+        if journal is not None:
+            self.journals.add(journal)
+        self._n_bytes_in_memory += len(bibtex)
+        if self._n_bytes_in_memory > self.max_bytes_in_memory:
+            self._spill()
+
+    def _spill(self):
+        run = TemporaryFile('w+', encoding='UTF-8')
+        for item in sorted(self._items):
+            run.write(json.dumps(item, ensure_ascii=False) + '\n')
+        self._runs.append(run)
+        self._items = []
+        self._n_bytes_in_memory = 0
+
+    def abort(self):
+        """Discard entries, leaving the BIB file as it was."""
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._items = []
+
+    def close(self):
+        items = heapq.merge(*map(_iter_run, self._runs), sorted(self._items))
+        path_temp = self.path_bib.with_name(
+            f'.{self.path_bib.name}.{uuid.uuid4().hex[:8]}.tmp')
+        try:
+            with open(path_temp, 'w', encoding='UTF-8') as f:
+                for i, (_, _, bibtex) in enumerate(items):
+                    if i:
+                        f.write('\n')
+                    f.write(bibtex)
+                    self.n_bytes += len(bibtex)
+            self.is_changed = not (
+                self.path_bib.is_file() and
+                filecmp.cmp(path_temp, self.path_bib, shallow=False))
+            if self.is_changed:
+                os.replace(path_temp, self.path_bib)
+        finally:
+            path_temp.unlink(missing_ok=True)
+            self.abort()
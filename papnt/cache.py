@@ -0,0 +1,133 @@
+import json
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Optional
+
+from .misc import load_config
+
+PREFIXES_DOI = r'^(https?://(dx\.)?doi\.org/|doi:\s*)'
+
+
+def normalize_doi(doi: str) -> str:
+    doi = re.sub(PREFIXES_DOI, '', doi.strip(), flags=re.IGNORECASE)
+    return doi.replace('//', '/').lower()
+
+
+def default_cache_dir() -> Path:
+    cache_dir = load_config(Path(__file__).parent / 'config.ini')['cache']['dir']
+    return Path(cache_dir) if cache_dir else Path.home() / '.cache' / 'papnt'
+
+
+class MetadataCache:
+    def __init__(self, path_db: str | Path, ttl_days: float=30.,
+                 max_entries: int=20000):
+        """
+        Information fetched from DOI, keyed by normalized DOI and source
+        ('crossref', 'jalc', 'arxiv').
+        Entries older than ttl_days are fetched again, and entries not used
+        recently are evicted when the number of entries exceeds max_entries.
+        """
+        Path(path_db).parent.mkdir(parents=True, exist_ok=True)
+        self.ttl = ttl_days * 24 * 60 * 60
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._conn = sqlite3.connect(str(path_db), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS metadata ('
+                'source TEXT, doi TEXT, info TEXT, '
+                'fetched_at REAL, accessed_at REAL, '
+                'PRIMARY KEY (source, doi))')
+
+    def get(self, source: str, doi: str) -> Optional[dict]:
+        with self._lock, self._conn:
+            return self._get((source, normalize_doi(doi)))
+
+    def _get(self, key: tuple) -> Optional[dict]:
+        """get() by (source, normalized DOI), called under the lock."""
+        row = self._conn.execute(
+            'SELECT info, fetched_at FROM metadata '
+            'WHERE source = ? AND doi = ?', key).fetchone()
+        if row is None:
+            return None
+        info, fetched_at = row
+        if time.time() - fetched_at > self.ttl:
+            self._conn.execute(
+                'DELETE FROM metadata WHERE source = ? AND doi = ?', key)
+            return None
+        self._conn.execute(
+            'UPDATE metadata SET accessed_at = ? '
+            'WHERE source = ? AND doi = ?', (time.time(), *key))
+        return json.loads(info)
+
+    def set(self, source: str, doi: str, info: dict):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?)',
+                (source, normalize_doi(doi), json.dumps(info), now, now))
+            self._evict()
+
+    def _evict(self):
+        n_entries = self._conn.execute(
+            'SELECT COUNT(*) FROM metadata').fetchone()[0]
+        if n_entries <= self.max_entries:
+            return
+        self._conn.execute(
+            'DELETE FROM metadata WHERE rowid IN ('
+            'SELECT rowid FROM metadata ORDER BY accessed_at LIMIT ?)',
+            (n_entries - self.max_entries,))
+
+    def fetch(self, source: str, doi: str, fetcher: Callable[[str], dict]
+              ) -> dict:
+        """
+        Return cached information, or call fetcher(doi) and cache its result.
+        Concurrent calls for the same DOI wait for the first one
+        instead of sending the same request again.
+        """
+        if (info := self.get(source, doi)) is not None:
+            return info
+
+        key = (source, normalize_doi(doi))
+        with self._lock, self._conn:
+            future = self._inflight.get(key)
+            is_owner = future is None
+            if is_owner:
+                # The owner of the same DOI may have finished since get()
+                if (info := self._get(key)) is not None:
+                    return info
+                future = self._inflight[key] = Future()
+        if not is_owner:
+            return future.result()
+
+        try:
+            info = fetcher(doi)
+            self.set(source, doi, info)
+            future.set_result(info)
+            return info
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_metadata_cache() -> MetadataCache:
+    global _default_cache
+    with _default_cache_lock:
+        if _default_cache is None:
+            config = load_config(Path(__file__).parent / 'config.ini')['cache']
+            _default_cache = MetadataCache(
+                default_cache_dir() / 'metadata.sqlite',
+                config['ttl_days'], config['max_entries'])
+    return _default_cache
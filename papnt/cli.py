@@ -1,30 +1,51 @@
 import os
+import sys
 from pathlib import Path
 
 import click
 from dotenv import load_dotenv
 
-from .database import Database, DatabaseInfo
-from .mainfunc import (add_records_from_local_pdfpath,
-                       make_abbrjson_from_bibpath, make_bibfile_from_records,
-                       update_unchecked_records_from_bib,
-                       update_unchecked_records_from_doi,
-                       update_unchecked_records_from_doi_jalc,
-                       update_unchecked_records_from_uploadedpdf)
 from .misc import load_config
+from .profiler import profiler
 
-global config, database
+# Commands import mainfunc and make Database when they run, so that
+# `papnt --help` does not wait for heavy modules or network clients.
+global config
 config = load_config(Path(__file__).parent / 'config.ini')
 load_dotenv(Path(__file__).parent / '.env')
 config['database']['tokenkey'] = os.getenv('TOKEN_KEY')
 config['database']['database_id'] = os.getenv('DATABASE_ID')
 config['misc']['dir_save_bib'] = os.getenv('DIR_SAVE_BIB')
-database = Database(DatabaseInfo())
+_database = None
+
+
+def _get_database():
+    from .cache import default_cache_dir
+    from .database import Database, DatabaseInfo
+    from .mirror import LocalMirror
+    from .transport import NotionTransport
+    global _database
+    if _database is None:
+        dbinfo = DatabaseInfo()
+        _database = Database(
+            dbinfo, NotionTransport(**config['notion']),
+            LocalMirror(default_cache_dir() / 'mirror.sqlite',
+                        dbinfo.database_id))
+    return _database
+
+
+def _get_doi_index():
+    """
+    DOIs in database, to skip records whose DOI is already recorded. They
+    are read from Notion, as local mirror keeps deleted or archived pages.
+    """
+    from .doiindex import DOIIndex
+    return DOIIndex(_get_database(), config['propnames'])
 
 
 def _config_is_ok():
-    tokenkey_is_empty = len(config['database']['tokenkey']) == 0
-    database_id_is_empty = len(config['database']['database_id']) == 0
+    tokenkey_is_empty = not config['database']['tokenkey']
+    database_id_is_empty = not config['database']['database_id']
     if tokenkey_is_empty or database_id_is_empty:
         click.echo('Open config.ini and edit database information: '
                    f'{Path(__file__).parent / "config.ini"}', err=True)
@@ -33,10 +54,27 @@ def _config_is_ok():
         return True
 
 
+def _report_profile(path_json: str | None):
+    click.echo(profiler.summary())
+    if 'papnt.pdf2doi' in sys.modules:  # Only if DOI was extracted from PDF
+        from .pdf2doi import print_extractor_stats
+        print_extractor_stats()
+    if path_json:
+        profiler.save(path_json)
+        click.echo(f'Profile was saved: {path_json}')
+
+
 # @click.group(context_settings=dict(help_option_names=['-h', '--help']))
 @click.group(invoke_without_command=True)
+@click.option('--profile', is_flag=True,
+              help='Show time, calls and bytes of each stage at the end')
+@click.option('--profile-json', type=click.Path(dir_okay=False),
+              help='Also save the profile to this JSON file')
 @click.pass_context
-def main(ctx):
+def main(ctx, profile: bool, profile_json: str | None):
+    if profile or profile_json:
+        profiler.enable()
+        ctx.call_on_close(lambda: _report_profile(profile_json))
     if ctx.invoked_subcommand is None:
         click.echo('try `papnt --help` for help')
         if _config_is_ok():
@@ -50,53 +88,114 @@ def paths(paths: str):
     """Add record(s) to database by local path to PDF file"""
     if not _config_is_ok():
         return
+    from .mainfunc import add_records_from_local_pdfpath
     SEP = ','
     paths = paths.split(SEP) if SEP in paths else [paths]
+    doi_index = _get_doi_index()
     for pdfpath in paths:
-        add_records_from_local_pdfpath(database, config['propnames'], pdfpath)
+        add_records_from_local_pdfpath(
+            _get_database(), config['propnames'], pdfpath,
+            config['concurrency'], doi_index=doi_index)
 
 
 @main.command()
 def doi():
     """Fill information in record(s) by DOI"""
     if _config_is_ok():
-        update_unchecked_records_from_doi(database, config['propnames'])
+        from .mainfunc import update_unchecked_records_from_doi
+        update_unchecked_records_from_doi(
+            _get_database(), config['propnames'], _get_doi_index())
 
 
 @main.command()
 def jalc():
     """Fill information in record(s) by DOI (JaLC API)"""
     if _config_is_ok():
-        update_unchecked_records_from_doi_jalc(database, config['propnames'])
+        from .mainfunc import update_unchecked_records_from_doi_jalc
+        update_unchecked_records_from_doi_jalc(
+            _get_database(), config['propnames'], _get_doi_index())
 
 
 @main.command()
 def bib():
     """Fill information in record(s) from bibfile"""
     if _config_is_ok():
-        update_unchecked_records_from_bib(database, config['propnames'])
+        from .mainfunc import update_unchecked_records_from_bib
+        update_unchecked_records_from_bib(_get_database(), config['propnames'])
 
 
 @main.command()
 def pdf():
     """Fill information in record(s) by uploaded PDF file"""
     if _config_is_ok():
+        from .mainfunc import update_unchecked_records_from_uploadedpdf
         update_unchecked_records_from_uploadedpdf(
-            database, config['propnames'])
+            _get_database(), config['propnames'], config['concurrency'],
+            _get_doi_index())
+
+
+@main.command()
+@click.option('--full', is_flag=True,
+              help='Download all records again instead of edited ones')
+def sync(full: bool):
+    """Update local mirror of database"""
+    if _config_is_ok():
+        n_pages = _get_database().sync_mirror(full)
+        click.echo(f'{n_pages} record(s) were synced.')
+
+
+@main.command()
+@click.option('--mirror', is_flag=True,
+              help='Read records from local mirror synced incrementally')
+@click.option('--dry-run', is_flag=True,
+              help='Only show citekeys to be changed')
+@click.option('--yes', '-y', is_flag=True,
+              help='Update without confirmation')
+def citekey(mirror: bool, dry_run: bool, yes: bool):
+    """Make citekeys of all records again without duplicates"""
+    if not _config_is_ok():
+        return
+    from .mainfunc import citekey_updates_of_records, update_citekeys_of_records
+    updates = citekey_updates_of_records(
+        _get_database(), config['propnames'], mirror)
+    for _, current, citekey in updates:
+        click.echo(f'{current or "(empty)"} -> {citekey}')
+    if not updates:
+        click.echo('All citekeys are up to date.')
+    elif dry_run:
+        click.echo(f'{len(updates)} citekey(s) would be updated.')
+    elif yes or click.confirm(f'Update {len(updates)} citekey(s)?'):
+        n_updated = update_citekeys_of_records(
+            _get_database(), config['propnames'], updates)
+        click.echo(f'{n_updated} citekey(s) were updated.')
 
 
 @main.command()
-@click.argument('target')
-def makebib(target: str):
-    """Make BIB file including reference information from database"""
+@click.argument('targets', nargs=-1)
+@click.option('--all', 'all_targets', is_flag=True,
+              help='Make BIB files of all tags in use')
+@click.option('--mirror', is_flag=True,
+              help='Read records from local mirror synced incrementally')
+def makebib(targets: tuple, all_targets: bool, mirror: bool):
+    """Make BIB file(s) including reference information from database"""
+    if not targets and not all_targets:
+        raise click.UsageError('Specify target(s) or --all')
     if not _config_is_ok():
         return
-    make_bibfile_from_records(
-        database, target, config['propnames'],
-        config['misc']['dir_save_bib'])
-    make_abbrjson_from_bibpath(
-        f'{config["misc"]["dir_save_bib"]}/{target}.bib',
-        config['abbr'])
+    from .mainfunc import make_abbrjson_from_journals, make_bibfiles_from_records
+    dir_save_bib = config['misc']['dir_save_bib']
+    writers = make_bibfiles_from_records(
+        _get_database(), None if all_targets else list(targets),
+        config['propnames'], dir_save_bib, mirror)
+    for target, writer in writers.items():
+        make_abbrjson_from_journals(
+            writer.journals, config['abbr'], f'{dir_save_bib}/{target}.json')
+        if writer.is_changed:
+            click.echo(f'{writer.n_entries} record(s) were written: '
+                       f'{writer.path_bib}')
+        else:
+            click.echo(f'{writer.path_bib} is up to date '
+                       f'({writer.n_entries} record(s)).')
 
 
 if __name__ == '__main__':
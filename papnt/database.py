@@ -1,11 +1,38 @@
 import os
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Literal, Optional
+from typing import Dict, Iterator, List, Literal, Optional, Tuple
 
 from dotenv import load_dotenv
 from notion_client import Client
 
+from .mirror import LocalMirror
 # from .misc import load_config
+from .profiler import profiler
+from .transport import NotionTransport
+
+N_RECORDS_PER_PAGE = 100
+MAX_N_BLOCKS_PER_REQUEST = 100
+
+
+def _split_nested_children(block: dict) -> Tuple[dict, List[dict]]:
+    """
+    Return the block which keeps up to 100 children without grandchildren,
+    and the children to be appended after the block is created.
+    """
+    for key, value in block.items():
+        if isinstance(value, dict) and value.get('children'):
+            children = value['children']
+            break
+    else:
+        return block, []
+    kept = [_split_nested_children(child)[0]
+            for child in children[:MAX_N_BLOCKS_PER_REQUEST]]
+    if any(kept_ is not child for kept_, child in zip(kept, children)):
+        # Grandchildren are not accepted, so children are appended later.
+        return block | {key: value | {'children': []}}, children
+    return (block | {key: value | {'children': kept}},
+            children[MAX_N_BLOCKS_PER_REQUEST:])
 
 
 class DatabaseInfo:
@@ -21,34 +48,125 @@ class DatabaseInfo:
 
 
 class Database:
-    def __init__(self, dbinfo: DatabaseInfo):
+    def __init__(self, dbinfo: DatabaseInfo,
+                 transport: Optional[NotionTransport]=None,
+                 mirror: Optional[LocalMirror]=None):
         self.notion = Client(auth=dbinfo.tokenkey)
         self.database_id = dbinfo.database_id
-
-    def fetch_records(self, filter: Optional[dict]=None, debugmode: bool=False
-                      ) -> List:
-        records = []
-        start_cursor = None
-        while True:
-            database = self.notion.databases.query(
+        self.transport = transport or NotionTransport()
+        self.mirror = mirror
+
+    def _query(self, filter: Optional[dict], start_cursor: Optional[str]
+               ) -> dict:
+        with profiler.stage('notion.query') as measure:
+            result = self.transport.call(
+                self.notion.databases.query,
                 database_id=self.database_id, filter=filter,
                 start_cursor=start_cursor)
-            records += database['results']
-            if not database['has_more']:
-                self.db_results = records
-                return self
-            start_cursor = database['next_cursor']
+            measure.count_bytes(result)
+        return result
+
+    def sync_mirror(self, full: bool=False) -> int:
+        if self.mirror is None:
+            raise RuntimeError('No local mirror is set to the database.')
+        with profiler.stage('mirror.sync'):
+            return self.mirror.sync(self, full)
+
+    def iter_pages(self, filter: Optional[dict]=None, use_mirror: bool=False,
+                   prefetch: bool=True) -> Iterator[List[dict]]:
+        """
+        Yield records by each page of query result (up to 100 records).
+        The next page is fetched in background while a page is processed.
+
+        prefetch: bool
+            Set False if records are updated out of the filter while they
+            are processed, so that the next page is queried only after the
+            current page has been processed.
+        """
+        if use_mirror:
+            self.sync_mirror()
+            with profiler.stage('mirror.query'):
+                records = self.mirror.query(filter)
+            for i in range(0, len(records), N_RECORDS_PER_PAGE):
+                yield records[i:i + N_RECORDS_PER_PAGE]
+            return
+
+        if not prefetch:
+            start_cursor = None
+            while True:
+                database = self._query(filter, start_cursor)
+                yield database['results']
+                if not database['has_more']:
+                    return
+                start_cursor = database['next_cursor']
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            next_page = executor.submit(self._query, filter, None)
+            while True:
+                database = next_page.result()
+                if database['has_more']:
+                    next_page = executor.submit(
+                        self._query, filter, database['next_cursor'])
+                yield database['results']
+                if not database['has_more']:
+                    return
+
+    def iter_records(self, filter: Optional[dict]=None, use_mirror: bool=False,
+                     prefetch: bool=True) -> Iterator[dict]:
+        for records in self.iter_pages(filter, use_mirror, prefetch):
+            yield from records
+
+    def fetch_records(self, filter: Optional[dict]=None, debugmode: bool=False,
+                      use_mirror: bool=False) -> List:
+        """
+        use_mirror: bool
+            Sync local mirror incrementally and query it instead of Notion.
+        """
+        records = []
+        for records_ in self.iter_pages(filter, use_mirror):
+            records += records_
             if debugmode:
                 print('It is debugmode, records were fetched partly.')
-                self.db_results = records
-                return self
+                break
+        self.db_results = records
+        return self
 
     def update_properties(self, page_id: str, prop: Dict):
-        self.notion.pages.update(page_id=page_id, properties=prop)
+        with profiler.stage('notion.update') as measure:
+            self.transport.call(
+                self.notion.pages.update, page_id=page_id, properties=prop)
+            measure.count_bytes(prop)
 
     def create(self, prop: Dict):
-        return self.notion.pages.create(
-            parent={'database_id': self.database_id}, properties=prop)
+        with profiler.stage('notion.create') as measure:
+            created = self.transport.call(
+                self.notion.pages.create, idempotent=False,
+                parent={'database_id': self.database_id}, properties=prop)
+            measure.count_bytes(prop)
+        return created
+
+    def _append_blocks(self, block_id: str, blocks: List[dict],
+                       executor: ThreadPoolExecutor, running: List[Future]):
+        """
+        Append blocks by chunks of 100 in order. Nested children which
+        Notion does not accept in one request (more than 100, or deeper than
+        2 levels) are appended to their created parent later, in parallel
+        with the following chunks.
+        """
+        for i in range(0, len(blocks), MAX_N_BLOCKS_PER_REQUEST):
+            chunk, overflows = zip(*[_split_nested_children(block)
+                                     for block in blocks[
+                                         i:i + MAX_N_BLOCKS_PER_REQUEST]])
+            with profiler.stage('notion.append') as measure:
+                response = self.transport.call(
+                    self.notion.blocks.children.append, idempotent=False,
+                    block_id=block_id, children=list(chunk))
+                measure.count_bytes(chunk)
+            for created, overflow in zip(response['results'], overflows):
+                if overflow:
+                    running.append(executor.submit(
+                        self._append_blocks, created['id'], overflow,
+                        executor, running))
 
     def add_children(self, page_id: str, contents: str | List | None,
                      blocktype: Literal['paragraph'], title: str='title'):
@@ -67,8 +185,7 @@ class Database:
                     return block
                 case 'toggle':
                     block |= {'type': blocktype,
-                              'toggle': make_text(title) |
-                                        {'children': contents}}
+                              'toggle': make_text(title)}
                     return block
 
                 case _:
@@ -77,8 +194,24 @@ class Database:
 
         if contents is None:
             return
-        self.notion.blocks.children.append(
-            block_id=page_id, children=[make_block(contents, blocktype)])
+        block = make_block(contents, blocktype)
+        with profiler.stage('notion.append') as measure:
+            response = self.transport.call(
+                self.notion.blocks.children.append, idempotent=False,
+                block_id=page_id, children=[block])
+            measure.count_bytes(block)
+        if blocktype != 'toggle':
+            return
+
+        # Toggle is created empty and filled by chunks of blocks
+        running = []
+        with ThreadPoolExecutor(
+                max_workers=self.transport.max_concurrent_requests
+                ) as executor:
+            self._append_blocks(response['results'][0]['id'], contents,
+                                executor, running)
+            while running:
+                running.pop(0).result()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,74 @@
+import threading
+from typing import Dict, Optional
+
+from .cache import normalize_doi
+from .database import Database
+
+
+class DOIIndex:
+    def __init__(self, database: Database, propnames: dict,
+                 use_mirror: bool=False):
+        """
+        Page ID of records in the database by normalized DOI, made from one
+        scan of records with DOI when first used. A DOI of several records
+        belongs to a checked one ('info'), or else the first one.
+
+        use_mirror: bool
+            Scan local mirror synced incrementally instead of Notion.
+            Pages deleted from Notion remain until `papnt sync --full`.
+        """
+        self.database = database
+        self.propname_doi = propnames['doi']
+        self.use_mirror = use_mirror
+        self._lock = threading.Lock()
+        self._page_ids: Optional[Dict[str, Optional[str]]] = None
+
+    def _build(self):
+        page_ids = {}
+        filter = {'property': self.propname_doi,
+                  'rich_text': {'is_not_empty': True}}
+        for record in self.database.iter_records(filter, self.use_mirror):
+            doi = ''.join(text['plain_text'] for text in
+                          record['properties'][self.propname_doi]['rich_text'])
+            doi = normalize_doi(doi)
+            is_checked = record['properties'].get('info', {}).get('checkbox')
+            if is_checked or doi not in page_ids:
+                page_ids[doi] = record['id']
+        self._page_ids = page_ids
+
+    def _ensure_built(self):
+        with self._lock:
+            if self._page_ids is None:
+                self._build()
+
+    def __contains__(self, doi: str) -> bool:
+        self._ensure_built()
+        with self._lock:
+            return normalize_doi(doi) in self._page_ids
+
+    def get(self, doi: str) -> Optional[str]:
+        """Page ID of the record with doi, None if not found or not created."""
+        self._ensure_built()
+        with self._lock:
+            return self._page_ids.get(normalize_doi(doi))
+
+    def add(self, doi: str, page_id: Optional[str]=None) -> bool:
+        """
+        Register doi, of the record to be created if page_id is None.
+        Return False if doi was already registered.
+        """
+        self._ensure_built()
+        with self._lock:
+            doi = normalize_doi(doi)
+            if doi in self._page_ids:
+                return False
+            self._page_ids[doi] = page_id
+            return True
+
+    def discard(self, doi: str):
+        """Unregister doi added for a record which failed to be created."""
+        self._ensure_built()
+        with self._lock:
+            doi = normalize_doi(doi)
+            if doi in self._page_ids and self._page_ids[doi] is None:
+                del self._page_ids[doi]
@@ -1,26 +1,66 @@
 import os
+import threading
 from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import Dict, Iterable, List, Tuple
 
 import requests
-from bibtexparser.bibdatabase import BibDatabase
-from bibtexparser.bwriter import BibTexWriter
 from dotenv import load_dotenv
 
-from .abbrlister import AbbrLister
+from .bibwriter import BibFileWriter, EntryCache, entry_to_bibtex
+from .cache import default_cache_dir
 from .database import Database
+from .doiindex import DOIIndex
 from .misc import FailLogger, load_config
-from .notionprop import NotionPropMaker, to_notionprop
-from .pdf2doi import pdf_to_doi
-from .pdf2text import PDF2ChildrenConverter
+from .notionprop import (CitekeyIndex, NotionPropMaker,
+                         citekey_from_notionprop, to_notionprop)
+from .pdfindex import PDFIndex, sha256_of_file
+from .pipeline import Pipeline, Stage
+from .profiler import profiler
 from .prop2entry import notionprop_to_entry
 
 DEBUGMODE = False
-converter = PDF2ChildrenConverter(
-    load_config(Path(__file__).parent / 'config.ini')['grobid']['server'])
+DOWNLOAD_CHUNKSIZE = 1 << 16
+DOWNLOAD_TIMEOUT = (10., 60.)  # (connect, read) in seconds
+
+# PDF2ChildrenConverter connects to GROBID, so it is made when first needed.
+# Modules for PDF and bib (PyMuPDF, pdf2doi, grobid_client, bibtexparser,
+# nltk) are also imported in the functions which need them, as importing
+# them takes most of the startup time of papnt.
+_converter = None
+_converter_lock = threading.Lock()
+
+
+def _get_converter():
+    from .pdf2text import PDF2ChildrenConverter
+    global _converter
+    with _converter_lock:
+        if _converter is None:
+            _converter = PDF2ChildrenConverter(load_config(
+                Path(__file__).parent / 'config.ini')['grobid']['server'])
+    return _converter
 
 
 def add_records_from_local_pdfpath(
-        database: Database, propnames: dict, input_pdfpath: str | Path):
+        database: Database, propnames: dict, input_pdfpath: str | Path,
+        concurrency: dict | None=None, pdfindex: PDFIndex | None=None,
+        doi_index: DOIIndex | None=None):
+    """
+    concurrency: dict
+        Number of workers for each stage, like...
+        {'doi': 4, 'metadata': 4, 'grobid': 2, 'notion': 2}
+    pdfindex: PDFIndex
+        PDFs found in it are skipped, or only their text is added if it
+        failed before. Recorded PDFs are added to it.
+    doi_index: DOIIndex
+        PDFs whose DOI is in it are skipped before fetching information.
+    """
+    from .pdf2doi import pdf_to_doi
+    converter = _get_converter()
+    concurrency = concurrency or {}
+    pdfindex = pdfindex or PDFIndex(
+        default_cache_dir() / 'pdfindex.sqlite', database.database_id)
+    doi_index = doi_index or DOIIndex(database, propnames)
 
     input_pdfpath = Path(input_pdfpath)
     if input_pdfpath.is_dir():
@@ -32,27 +72,115 @@ def add_records_from_local_pdfpath(
                           'Please specify a directory or a PDF file.')
 
     logger = FailLogger()
-    for pdf_path in pdf_paths:
-        logger.set_path(pdf_path)
-        doi = pdf_to_doi(pdf_path) or logger.log_no_doi_extracted()
+    hashes_in_run = set()
+    lock = threading.Lock()
+
+    def extract_doi(pdf_path: Path):
+        with profiler.stage('pdf.sha256') as measure:
+            measure.add_bytes(pdf_path.stat().st_size)
+            sha256 = sha256_of_file(pdf_path)
+        with lock:
+            is_in_run = sha256 in hashes_in_run
+            hashes_in_run.add(sha256)
+        recorded = None if is_in_run else pdfindex.get(sha256)
+        if is_in_run or (recorded is not None and recorded[2]):
+            print(f'Already recorded: {pdf_path}')
+            return None
+        if recorded is not None:  # Text was not added to the created page
+            id_recorded, doi, _ = recorded
+            return pdf_path, sha256, doi, id_recorded
+        doi = pdf_to_doi(pdf_path)
         if doi is None:
-            continue
+            logger.log_no_doi_extracted(pdf_path)
+            return None
+        if not doi_index.add(doi):
+            # Not added to pdfindex, as the text of this PDF is not added
+            print(f'Already recorded DOI: {pdf_path} ({doi})')
+            return None
+        return pdf_path, sha256, doi, None
+
+    def make_prop(item: tuple):
+        pdf_path, sha256, doi, id_recorded = item
+        if id_recorded is not None:
+            return pdf_path, sha256, doi, id_recorded, None
         try:
             prop = NotionPropMaker().from_doi(doi, propnames) | \
                    {'info': {'checkbox': True}}
         except Exception as e:
-            logger.log_no_doi_info(doi)
+            logger.log_no_doi_info(doi, pdf_path)
             prop = to_notionprop(pdf_path.name, 'title')
-        created_page_id = database.create(prop)['id']
-        children = converter.convert(pdf_path)
-        database.add_children(created_page_id, children, blocktype='toggle',
+        return pdf_path, sha256, doi, None, prop
+
+    def create(item: tuple):
+        pdf_path, sha256, doi, page_id, prop = item
+        if page_id is None:
+            try:
+                page_id = database.create(prop)['id']
+            except Exception:
+                doi_index.discard(doi)  # To be tried again in the next run
+                raise
+            pdfindex.add(sha256, page_id, doi)
+        return pdf_path, (page_id, sha256, doi)
+
+    def log_failed(item: Path | tuple, error: Exception):
+        logger.log_failed(error, item if isinstance(item, Path) else item[0])
+
+    pipeline = Pipeline([
+        Stage('doi', extract_doi, concurrency.get('doi', 1), log_failed),
+        Stage('metadata', make_prop, concurrency.get('metadata', 1),
+              log_failed),
+        Stage('notion', create, concurrency.get('notion', 1), log_failed)])
+
+    created_pages = {}
+    def created_pdf_paths():
+        for pdf_path, created_page in pipeline.run(pdf_paths):
+            created_pages[pdf_path] = created_page
+            yield pdf_path
+
+    for pdf_path, children, error in converter.convert_many(
+            created_pdf_paths(), concurrency.get('grobid', 1)):
+        page_id, sha256, doi = created_pages.pop(pdf_path)
+        if error is not None:
+            print(f'Failed to extract text by GROBID: {pdf_path} ({error})')
+        database.add_children(page_id, children, blocktype='toggle',
                               title='Text extracted by GROBID')
+        if error is None:  # Or the text is tried again in the next run
+            pdfindex.add(sha256, page_id, doi, is_text_added=True)
         print(f'Recorded: {pdf_path}')
 
     shallowest_pdf = min(pdf_paths, key=lambda p: len(p.parts))
     logger.export_to_text(shallowest_pdf.parent)
 
 
+def _doi_of_record(record: dict) -> str:
+    return record['properties']['DOI']['rich_text'][0]['plain_text']
+
+
+def _claim_doi(database: Database, doi_index: DOIIndex, doi: str,
+               id_record: str, propnames: dict) -> bool:
+    """
+    Register DOI of the record. False if another record has the DOI, and
+    then the record is checked with the DOI and a note on the duplication,
+    not to be processed again.
+    """
+    if doi_index.add(doi, id_record):
+        return True
+    id_owner = doi_index.get(doi)
+    if id_owner == id_record:
+        return True
+    owner = ('a record of this run' if id_owner is None
+             else f'https://www.notion.so/{id_owner.replace("-", "")}')
+    print(f'Skipped, as DOI is of another record: {doi} '
+          f'({id_record} duplicates {owner})')
+    database.update_properties(
+        id_record, {propnames['doi']: to_notionprop(doi, 'rich_text'),
+                    'info': {'checkbox': True}})
+    database.add_children(
+        id_record, f'Not updated, as DOI ({doi}) is of another record: {owner}',
+        'paragraph')
+    return False
+
+
 def _update_record_from_doi(
         database: Database, doi: str, id_record: str, propnames: dict):
 
@@ -70,13 +198,26 @@ def _update_record_from_doi(
         raise ValueError(f'Error while updating record: {name}')
 
 
-def update_unchecked_records_from_doi(database: Database, propnames: dict):
+def update_unchecked_records_from_doi(database: Database, propnames: dict,
+                                      doi_index: DOIIndex | None=None):
+    """
+    doi_index: DOIIndex
+        Records whose DOI is of another record are only checked with a note.
+    """
+    doi_index = doi_index or DOIIndex(database, propnames)
     filter = {
         'and': [{'property': 'info', 'checkbox': {'equals': False}},
                 {'property': 'DOI', 'rich_text': {'is_not_empty': True}}]}
-    for record in database.fetch_records(filter).db_results:
-        doi = record['properties']['DOI']['rich_text'][0]['plain_text']
-        _update_record_from_doi(database, doi, record['id'], propnames)
+    for records in database.iter_pages(filter, prefetch=False):
+        records = [
+            record for record in records if _claim_doi(
+                database, doi_index, _doi_of_record(record), record['id'],
+                propnames)]
+        dois = [_doi_of_record(record) for record in records]
+        with profiler.stage('metadata.prefetch'):
+            NotionPropMaker().prefetch_from_doi(dois)
+        for doi, record in zip(dois, records):
+            _update_record_from_doi(database, doi, record['id'], propnames)
 
 
 def _update_record_from_doi_jalc(
@@ -96,12 +237,16 @@ def _update_record_from_doi_jalc(
         raise ValueError(f'Error while updating record: {name}')
 
 
-def update_unchecked_records_from_doi_jalc(database: Database, propnames: dict):
+def update_unchecked_records_from_doi_jalc(
+        database: Database, propnames: dict, doi_index: DOIIndex | None=None):
+    doi_index = doi_index or DOIIndex(database, propnames)
     filter = {
         'and': [{'property': 'info', 'checkbox': {'equals': False}},
                 {'property': 'DOI', 'rich_text': {'is_not_empty': True}}]}
-    for record in database.fetch_records(filter).db_results:
-        doi = record['properties']['DOI']['rich_text'][0]['plain_text']
+    for record in database.iter_records(filter, prefetch=False):
+        doi = _doi_of_record(record)
+        if not _claim_doi(database, doi_index, doi, record['id'], propnames):
+            continue
         _update_record_from_doi_jalc(database, doi, record['id'], propnames)
 
 
@@ -126,55 +271,268 @@ def update_unchecked_records_from_bib(database: Database, propnames: dict):
     filter = {
         'and': [{'property': 'info', 'checkbox': {'equals': False}},
                 {'property': 'bibtex', 'rich_text': {'is_not_empty': True}}]}
-    for record in database.fetch_records(filter).db_results:
+    for record in database.iter_records(filter, prefetch=False):
         bibtex_str = record['properties']['bibtex']['rich_text'][0]['plain_text']
         _update_record_from_bib(database, bibtex_str, record['id'], propnames)
 
 
+def _make_session(n_connections: int) -> requests.Session:
+    """Session which keeps up to n_connections connections alive."""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=n_connections, pool_maxsize=n_connections)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def _download_to_tempfile(session: requests.Session, url: str) -> str:
+    """Stream file at url into a new temporary PDF file and return its path."""
+    with profiler.stage('download') as measure, \
+            session.get(url, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+        response.raise_for_status()
+        with NamedTemporaryFile(suffix='.pdf', delete=False) as f:
+            try:
+                for chunk in response.iter_content(DOWNLOAD_CHUNKSIZE):
+                    f.write(chunk)
+                    measure.add_bytes(len(chunk))
+            except Exception:
+                f.close()
+                Path(f.name).unlink()
+                raise
+    return f.name
+
+
 def update_unchecked_records_from_uploadedpdf(
-        database: Database, propnames: dict):
-    PATH_TEMP_PDF = Path('you-can-delete-this-file.pdf')
+        database: Database, propnames: dict, concurrency: dict | None=None,
+        doi_index: DOIIndex | None=None):
+    """
+    doi_index: DOIIndex
+        Records whose PDF has DOI of another record are only checked with
+        a note, before GROBID and fetching information.
+    """
+    from .pdf2doi import pdf_to_doi
+    converter = _get_converter()
+    concurrency = concurrency or {}
+    doi_index = doi_index or DOIIndex(database, propnames)
     filter = {
         'and': [{'property': 'info', 'checkbox': {'equals': False}},
                 {'property': propnames['pdf'],
                  'files': {'is_not_empty': True}}]}
-    for record in database.fetch_records(filter).db_results:
+
+    n_downloads = concurrency.get('download', 1)
+    session = _make_session(n_downloads)
+    stopped = threading.Event()  # Set when the conversion below stops
+
+    def download(record: dict):
+        if stopped.is_set():
+            return None
         fileurl = record['properties'][propnames['pdf']]
         fileurl = fileurl['files'][0]['file']['url']
-        pdffile = requests.get(fileurl).content
-        with PATH_TEMP_PDF.open(mode='wb') as f:
-            f.write(pdffile)
-        doi = pdf_to_doi(PATH_TEMP_PDF)
-        children = converter.convert(PATH_TEMP_PDF)
-        database.add_children(record['id'], children, blocktype='toggle',
-                              title='Text extracted by GROBID')
-        PATH_TEMP_PDF.unlink()
-        if doi is None:
-            continue
-        _update_record_from_doi(database, doi, record['id'], propnames)
-
+        return record['id'], _download_to_tempfile(session, fileurl)
 
-def make_bibfile_from_records(database: Database, target: str,
-                              propnames: dict, dir_save_bib: str):
+    def extract_doi(item: tuple):
+        id_record, path_pdf = item
+        if stopped.is_set():
+            Path(path_pdf).unlink()
+            return None
+        try:
+            doi = pdf_to_doi(path_pdf)
+        except Exception:
+            Path(path_pdf).unlink()
+            raise
+        if doi is not None and not _claim_doi(
+                database, doi_index, doi, id_record, propnames):
+            Path(path_pdf).unlink()
+            return None
+        return id_record, path_pdf, doi
+
+    pipeline = Pipeline([
+        Stage('download', download, n_downloads),
+        Stage('doi', extract_doi, concurrency.get('doi', 1))])
+
+    # Records are updated out of the filter while the pipeline reads ahead,
+    # so all of them are queried before the first update.
+    records = list(database.iter_records(filter))
+    downloaded = {}
+    def downloaded_pdf_paths():
+        results = pipeline.run(records)
+        try:
+            for id_record, path_pdf, doi in results:
+                downloaded[path_pdf] = id_record, doi
+                yield path_pdf
+        finally:
+            # Not converted further: PDFs left in the pipeline are deleted
+            stopped.set()
+            for _, path_pdf, _ in results:
+                Path(path_pdf).unlink()
+
+    path_pdf = None
+    pdf_paths = downloaded_pdf_paths()
+    results = converter.convert_many(pdf_paths, concurrency.get('grobid', 1))
+    with session:
+        try:
+            for path_pdf, children, error in results:
+                id_record, doi = downloaded.pop(path_pdf)
+                if error is not None:
+                    print('Failed to extract text by GROBID: '
+                          f'{path_pdf} ({error})')
+                database.add_children(id_record, children, blocktype='toggle',
+                                      title='Text extracted by GROBID')
+                Path(path_pdf).unlink()
+                if doi is None:
+                    continue
+                _update_record_from_doi(database, doi, id_record, propnames)
+        finally:
+            # Temporary PDFs are left if an update above fails
+            results.close()  # Waits for the conversions and closes pdf_paths
+            pdf_paths.close()
+            for path_pdf_ in [path_pdf, *downloaded]:
+                if path_pdf_ is not None:
+                    Path(path_pdf_).unlink(missing_ok=True)
+
+
+def _plain_text(prop: dict) -> str:
+    return ''.join(text['plain_text'] for text in prop['rich_text'])
+
+
+def citekey_updates_of_records(database: Database, propnames: dict,
+                               use_mirror: bool=False
+                               ) -> List[Tuple[str, str, str]]:
+    """
+    Make citekeys of all records again from their author, title and year.
+    Duplicated citekeys get suffixes (a, b, c, ...) in order of creation.
+    Return (id_record, current, citekey) of records whose citekey changes,
+    without updating them.
+    """
+    records = []
+    index = CitekeyIndex()
+    for record in database.iter_records(None, use_mirror):
+        properties = record['properties']
+        current = _plain_text(properties[propnames['id']])
+        citekey = citekey_from_notionprop(properties, propnames)
+        if citekey is None:  # Kept as it is, and not given to others
+            index.citekeys.add(current)
+            continue
+        records.append((record['created_time'], record['id'], current,
+                        citekey))
+
+    updates = []
+    for _, id_record, current, citekey in sorted(records):
+        citekey = index.add(citekey)
+        if citekey != current:
+            updates.append((id_record, current, citekey))
+    return updates
+
+
+def update_citekeys_of_records(database: Database, propnames: dict,
+                               updates: List[Tuple[str, str, str]]) -> int:
+    """updates: (id_record, current, citekey) by citekey_updates_of_records"""
+    for id_record, current, citekey in updates:
+        database.update_properties(
+            id_record, {propnames['id']: to_notionprop(citekey, 'rich_text')})
+    return len(updates)
+
+
+def _output_target_filter(propname: str, targets: List[str] | None) -> dict:
+    if targets is None:
+        return {'property': propname, 'multi_select': {'is_not_empty': True}}
+    return {'or': [{'property': propname, 'multi_select': {'contains': target}}
+                   for target in targets]}
+
+
+def make_bibfiles_from_records(database: Database, targets: List[str] | None,
+                               propnames: dict, dir_save_bib: str,
+                               use_mirror: bool=False,
+                               entry_cache: EntryCache | None=None
+                               ) -> Dict[str, BibFileWriter]:
+    """
+    Make BIB file of each target from one scan of database. Entries are
+    written as records arrive, so memory does not grow with the number of
+    records. Return the writers, which have the number of entries and
+    journal names of each target.
+
+    targets: list of str
+        Tags of output_target property. None means all tags in use.
+    entry_cache: EntryCache
+        Entries of records not edited since the last makebib are taken from
+        it instead of being rendered again. With all tags (targets is None),
+        entries of records no longer found are deleted from it.
+    """
     if dir_save_bib == '':
         raise RuntimeError('Edit "dir_save_bib" key in config.ini')
+    entry_cache = entry_cache or EntryCache(
+        default_cache_dir() / 'entries.sqlite', database.database_id,
+        propnames)
 
     propname_to_bibname = {val: key for key, val in propnames.items()}
-    filter = {'property': propnames['output_target'],
-              'multi_select': {'contains': target}}
-    entries = [notionprop_to_entry(record['properties'], propname_to_bibname)
-               for record in database.fetch_records(filter).db_results]
+    filter = _output_target_filter(propnames['output_target'], targets)
+    writers = {target: BibFileWriter(f'{dir_save_bib}/{target}.bib')
+               for target in (targets or [])}
+    page_ids = set()  # Of all records with entries, if targets is None
+    try:
+        for records in database.iter_pages(filter, use_mirror):
+            if targets is None:
+                page_ids.update(record['id'] for record in records)
+            cached = entry_cache.get_many(records)
+            rendered = {}
+            for record in records:
+                tags = [tag['name'] for tag in record['properties'][
+                    propnames['output_target']]['multi_select']]
+                if targets is not None:
+                    tags = [tag for tag in tags if tag in writers]
+                if not tags:
+                    continue
+                if (entry := cached.get(record['id'])) is None:
+                    with profiler.stage('makebib.render'):
+                        entry_ = notionprop_to_entry(
+                            record['properties'], propname_to_bibname)
+                        entry = (entry_['ID'], entry_.get('journal'),
+                                 entry_to_bibtex(entry_))
+                    rendered[record['id']] = \
+                        record['last_edited_time'], entry
+                citekey, journal, bibtex = entry
+                for tag in tags:
+                    if tag not in writers:
+                        writers[tag] = BibFileWriter(
+                            f'{dir_save_bib}/{tag}.bib')
+                    writers[tag].add_bibtex(citekey, bibtex, journal)
+            entry_cache.set_many(rendered)
+        if targets is None:
+            entry_cache.prune(page_ids)
+
+        for writer in writers.values():
+            with profiler.stage('makebib.write') as measure:
+                writer.close()
+                measure.add_bytes(writer.n_bytes)
+    except BaseException:
+        for writer in writers.values():
+            writer.abort()
+        raise
+    return writers
+
+
+def make_bibfile_from_records(database: Database, target: str,
+                              propnames: dict, dir_save_bib: str,
+                              use_mirror: bool=False,
+                              entry_cache: EntryCache | None=None):
+    make_bibfiles_from_records(
+        database, [target], propnames, dir_save_bib, use_mirror, entry_cache)
+
 
-    bib_db = BibDatabase()
-    bib_db.entries = entries
-    writer = BibTexWriter()
-    output_path = f'{dir_save_bib}/{target}.bib'
-    open(output_path, 'w', encoding='UTF-8').write(writer.write(bib_db))
+def make_abbrjson_from_journals(names_journal: Iterable[str],
+                                special_abbr: dict, save_path: str):
+    from .abbrlister import AbbrLister
+    with profiler.stage('makebib.abbr'):
+        lister = AbbrLister.from_journals(names_journal)
+        lister.listup(special_abbr).save(save_path)
 
 
 def make_abbrjson_from_bibpath(input_bibpath: str, special_abbr: dict):
-    lister = AbbrLister(input_bibpath)
-    lister.listup(special_abbr).save(input_bibpath.replace('.bib', '.json'))
+    from .abbrlister import AbbrLister
+    with profiler.stage('makebib.abbr'):
+        lister = AbbrLister(input_bibpath)
+        lister.listup(special_abbr).save(input_bibpath.replace('.bib', '.json'))
 
 
 if __name__ == '__main__':
@@ -190,10 +548,11 @@ if __name__ == '__main__':
     database = Database(DatabaseInfo())
 
     add_records_from_local_pdfpath(
-        database, config['propnames'], 'test/samplepdfs/sample1.pdf')
+        database, config['propnames'], 'test/samplepdfs/sample1.pdf',
+        config['concurrency'])
     update_unchecked_records_from_doi(database, config['propnames'])
     update_unchecked_records_from_uploadedpdf(
-        database, config['propnames'])
+        database, config['propnames'], config['concurrency'])
     make_bibfile_from_records(
         database, 'test', config['propnames'], config['misc']['dir_save_bib'])
     make_abbrjson_from_bibpath(
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from typing import TYPE_CHECKING, List, Optional
+
+if TYPE_CHECKING:
+    from .database import Database
+
+
+def _plain_text(prop: dict) -> str:
+    return ''.join(text['plain_text'] for text in prop[prop['type']])
+
+
+def _match_property(prop: dict, condition: dict) -> bool:
+    proptype = prop['type']
+    if proptype not in condition:
+        raise ValueError(f'Filter not supported: {condition}')
+    (operator, value), = condition[proptype].items()
+    match proptype:
+        case 'checkbox':
+            if operator == 'equals':
+                return prop['checkbox'] == value
+            if operator == 'does_not_equal':
+                return prop['checkbox'] != value
+        case 'title' | 'rich_text':
+            text = _plain_text(prop)
+            match operator:
+                case 'is_empty': return text == ''
+                case 'is_not_empty': return text != ''
+                case 'equals': return text == value
+                case 'does_not_equal': return text != value
+                case 'contains': return value.lower() in text.lower()
+                case 'does_not_contain':
+                    return value.lower() not in text.lower()
+        case 'files':
+            match operator:
+                case 'is_empty': return len(prop['files']) == 0
+                case 'is_not_empty': return len(prop['files']) > 0
+        case 'multi_select':
+            names = [option['name'] for option in prop['multi_select']]
+            match operator:
+                case 'is_empty': return len(names) == 0
+                case 'is_not_empty': return len(names) > 0
+                case 'contains': return value in names
+                case 'does_not_contain': return value not in names
+        case 'select':
+            name = prop['select'] and prop['select']['name']
+            match operator:
+                case 'is_empty': return name is None
+                case 'is_not_empty': return name is not None
+                case 'equals': return name == value
+                case 'does_not_equal': return name != value
+        case 'number':
+            match operator:
+                case 'is_empty': return prop['number'] is None
+                case 'is_not_empty': return prop['number'] is not None
+                case 'equals': return prop['number'] == value
+                case 'does_not_equal': return prop['number'] != value
+    raise ValueError(f'Filter not supported: {condition}')
+
+
+def match_filter(page: dict, filter: Optional[dict]) -> bool:
+    """Evaluate a filter of Notion database query on a page locally."""
+    if filter is None:
+        return True
+    if 'and' in filter:
+        return all(match_filter(page, filter_) for filter_ in filter['and'])
+    if 'or' in filter:
+        return any(match_filter(page, filter_) for filter_ in filter['or'])
+    if 'property' in filter:
+        return _match_property(page['properties'][filter['property']], filter)
+    raise ValueError(f'Filter not supported: {filter}')
+
+
+class LocalMirror:
+    def __init__(self, path_db: str | Path, database_id: str):
+        """
+        Copy of the pages in Notion database, kept in SQLite.
+        Pages edited after the last sync are pulled by sync().
+        Pages deleted from Notion remain until sync(full=True).
+        """
+        Path(path_db).parent.mkdir(parents=True, exist_ok=True)
+        self.database_id = database_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path_db), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS pages ('
+                'database_id TEXT, id TEXT, last_edited_time TEXT, page TEXT, '
+                'PRIMARY KEY (database_id, id))')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS cursors ('
+                'database_id TEXT PRIMARY KEY, last_edited_time TEXT)')
+
+    def _cursor(self) -> Optional[str]:
+        row = self._conn.execute(
+            'SELECT last_edited_time FROM cursors WHERE database_id = ?',
+            (self.database_id,)).fetchone()
+        return row and row[0]
+
+    def sync(self, database: 'Database', full: bool=False) -> int:
+        """Pull pages edited since the last sync. Return number of them."""
+        with self._lock:
+            cursor = None if full else self._cursor()
+        filter = None if cursor is None else {
+            'timestamp': 'last_edited_time',
+            'last_edited_time': {'on_or_after': cursor}}
+        pages = list(database.iter_records(filter))
+
+        with self._lock, self._conn:
+            if cursor is None:
+                self._conn.execute('DELETE FROM pages WHERE database_id = ?',
+                                   (self.database_id,))
+            self._conn.executemany(
+                'INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?)',
+                [(self.database_id, page['id'], page['last_edited_time'],
+                  json.dumps(page)) for page in pages])
+            last_edited_times = [page['last_edited_time'] for page in pages]
+            if cursor is not None:
+                last_edited_times.append(cursor)
+            if last_edited_times:
+                self._conn.execute(
+                    'INSERT OR REPLACE INTO cursors VALUES (?, ?)',
+                    (self.database_id, max(last_edited_times)))
+        return len(pages)
+
+    def query(self, filter: Optional[dict]=None) -> List[dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT page FROM pages WHERE database_id = ? '
+                'ORDER BY rowid', (self.database_id,)).fetchall()
+        pages = (json.loads(row[0]) for row in rows)
+        return [page for page in pages if match_filter(page, filter)]
@@ -1,5 +1,6 @@
 from pathlib import Path
 import configparser
+import threading
 
 
 def load_config(ini_path: str) -> dict:
@@ -23,20 +24,32 @@ class FailLogger:
     def __init__(self):
         self.no_doi_extracted = []
         self.no_doi_info = []
+        self.failed = []
+        self._lock = threading.Lock()
 
     def set_path(self, pdf_path: str | Path):
         self.pdf_path = pdf_path
 
-    def log_no_doi_extracted(self):
-        print('DOI could not be extracted from PDF: {self.pdf_path.name}')
-        self.no_doi_extracted.append(self.pdf_path.name)
+    def log_no_doi_extracted(self, pdf_path: str | Path | None=None):
+        name = Path(pdf_path or self.pdf_path).name
+        print(f'DOI could not be extracted from PDF: {name}')
+        with self._lock:
+            self.no_doi_extracted.append(name)
 
-    def log_no_doi_info(self, doi: str):
-        print(f'No information on found DOI: {self.pdf_path.name} ({doi})')
-        self.no_doi_info.append((self.pdf_path.name, doi))
+    def log_no_doi_info(self, doi: str, pdf_path: str | Path | None=None):
+        name = Path(pdf_path or self.pdf_path).name
+        print(f'No information on found DOI: {name} ({doi})')
+        with self._lock:
+            self.no_doi_info.append((name, doi))
+
+    def log_failed(self, error: Exception, pdf_path: str | Path | None=None):
+        name = Path(pdf_path or self.pdf_path).name
+        print(f'Failed to record: {name} ({error!r})')
+        with self._lock:
+            self.failed.append((name, repr(error)))
 
     def export_to_text(self, path_log_text_output: str | Path):
-        if not (self.no_doi_extracted or self.no_doi_info):
+        if not (self.no_doi_extracted or self.no_doi_info or self.failed):
             return
         with (Path(path_log_text_output) / 'skipped-files.txt').open('w') as f:
             if self.no_doi_extracted:
@@ -50,3 +63,8 @@ class FailLogger:
                     f.write(f"{filename}: ")
                     if doi:
                         f.write(f"https://doi.org/{doi}\n")
+
+            if self.failed:
+                f.write('\n# Failed to record\n')
+                for filename, error in self.failed:
+                    f.write(f"{filename}: {error}\n")
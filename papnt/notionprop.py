@@ -1,14 +1,76 @@
 import datetime
 import re
 import string
-from typing import Any, List, Literal, Optional
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Literal, Optional
+from urllib.parse import quote
 
-import arxiv
 import requests
-from crossref.restful import Works
 from unidecode import unidecode
 
+from .cache import MetadataCache, get_metadata_cache
 from .const import CROSSREF_TO_BIB, SKIPWORDS
+from .profiler import profiler
+
+if TYPE_CHECKING:
+    import arxiv
+
+CROSSREF_API = 'https://api.crossref.org'
+JALC_API = 'https://api.japanlinkcenter.org'
+BATCHSIZE_CROSSREF = 50
+CROSSREF_TIMEOUT = (10., 60.)  # (connect, read) in seconds
+BATCHSIZE_ARXIV = 100
+
+# arXiv client keeps the time of the last request to throttle itself,
+# so one client is shared through the run.
+_arxiv_client = None
+_arxiv_lock = threading.Lock()
+
+
+def _arxiv_results(arxiv_ids: List[str]) -> List['arxiv.Result']:
+    import arxiv  # Imported only when arXiv is needed, as it is slow
+    global _arxiv_client
+    with _arxiv_lock:
+        if _arxiv_client is None:
+            _arxiv_client = arxiv.Client()
+        search = arxiv.Search(id_list=arxiv_ids, max_results=len(arxiv_ids))
+        return list(_arxiv_client.results(search))
+
+
+def _remove_arxiv_version(arxiv_id: str) -> str:
+    return re.sub(r'v\d+$', '', arxiv_id)
+
+
+PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# Skip words in title are removed in lower, UPPER and Capitalized forms,
+# in this order, which is kept as the order changes some results.
+SKIPWORD_FORMS = [form for word in SKIPWORDS
+                  for form in (word, word.upper(), word[0].upper() + word[1:])]
+SKIPWORD_STEPS = {}
+for i, form in enumerate(SKIPWORD_FORMS):
+    SKIPWORD_STEPS.setdefault(form, []).append(i)
+
+
+def _remove_skipwords(words: List[str]) -> List[str]:
+    """
+    Remove skip words from words split by a space, as replacing each
+    ' skipword ' by ' ' in the title does. The replacement does not match
+    a word right after the removed same word, as they share the space.
+    """
+    steps = sorted({i for word in words for i in SKIPWORD_STEPS.get(word, ())})
+    for i in steps:
+        form = SKIPWORD_FORMS[i]
+        kept = []
+        prev_is_removed = False
+        for word in words:
+            if word == form and not prev_is_removed:
+                prev_is_removed = True
+                continue
+            kept.append(word)
+            prev_is_removed = False
+        words = kept
+    return words
 
 
 def to_notionprop(content: Optional[Any],
@@ -61,15 +123,71 @@ def to_notionprop(content: Optional[Any],
 
 
 class NotionPropMaker:
-    def __init__(self):
+    def __init__(self, cache: MetadataCache | None=None):
         self.notes = []
+        self.cache = cache or get_metadata_cache()
 
     def from_doi(self, doi: str, propnames: dict) -> dict:
+        return self._make_properties(self.info_from_doi(doi), propnames)
+
+    def info_from_doi(self, doi: str) -> dict:
+        """Information on DOI from arXiv or Crossref, through the cache."""
         if 'arXiv' in doi:
-            doi_style_info = self._fetch_info_from_arxiv(doi)
+            return self._fetch_info_from_arxiv(doi)
         else:
-            doi_style_info = self._fetch_info_from_doi(doi)
-        return self._make_properties(doi_style_info, propnames)
+            return self._fetch_info_from_doi(doi)
+
+    def prefetch_from_doi(self, dois: List[str]):
+        """
+        Fetch information on many DOIs from Crossref and arXiv by few
+        requests and store them in cache, so that from_doi() does not send
+        a request. DOIs not found in the batch responses are left to
+        from_doi().
+        """
+        dois = list(dict.fromkeys(doi.replace('//', '/') for doi in dois))
+        dois_arxiv = [doi for doi in dois if 'arXiv' in doi
+                      and self.cache.get('arxiv', doi) is None]
+        dois = [doi for doi in dois if 'arXiv' not in doi
+                and self.cache.get('crossref', doi) is None]
+        for i in range(0, len(dois), BATCHSIZE_CROSSREF):
+            batch = dois[i:i + BATCHSIZE_CROSSREF]
+            try:
+                infos = self._request_crossref_batch(batch)
+            except Exception as e:
+                print(f'Batch request to Crossref failed: {e}')
+                continue
+            for info in infos:
+                self.cache.set('crossref', info['DOI'], info)
+
+        for i in range(0, len(dois_arxiv), BATCHSIZE_ARXIV):
+            batch = {_remove_arxiv_version(doi.split('arXiv.')[1]): doi
+                     for doi in dois_arxiv[i:i + BATCHSIZE_ARXIV]}
+            try:
+                with profiler.stage('arxiv.batch'):
+                    papers = _arxiv_results(list(batch))
+            except Exception as e:
+                print(f'Batch request to arXiv failed: {e}')
+                continue
+            for paper in papers:
+                doi = batch.get(_remove_arxiv_version(paper.get_short_id()))
+                if doi is not None:
+                    self.cache.set('arxiv', doi, self._arxiv_to_info(paper, doi))
+
+    def _request_crossref_batch(self, dois: List[str]) -> List[dict]:
+        # Comma separates DOIs in the filter, so DOIs with it are left to
+        # the request of single DOI.
+        dois = [doi for doi in dois if ',' not in doi]
+        if not dois:
+            return []
+        with profiler.stage('crossref.batch') as measure:
+            response = requests.get(
+                f'{CROSSREF_API}/works',
+                params={'filter': ','.join(f'doi:{doi}' for doi in dois),
+                        'rows': len(dois)},
+                timeout=CROSSREF_TIMEOUT)
+            measure.count_bytes(response.content)
+        response.raise_for_status()
+        return response.json()['message']['items']
 
     def from_doi_jalc(self, doi: str, propnames: dict) -> dict:
         doi_style_info = self._fetch_info_from_doi_jalc(doi)
@@ -82,9 +200,15 @@ class NotionPropMaker:
 
     def _fetch_info_from_arxiv(self, doi: str) -> dict:
         doi = doi.replace('//', '/')
+        return self.cache.fetch('arxiv', doi, self._request_arxiv)
+
+    def _request_arxiv(self, doi: str) -> dict:
         arxiv_id = doi.split('arXiv.')[1]
-        paper = next(arxiv.Client().results(arxiv.Search(id_list=[arxiv_id])))
+        with profiler.stage('arxiv'):
+            paper = next(iter(_arxiv_results([arxiv_id])))
+        return self._arxiv_to_info(paper, doi)
 
+    def _arxiv_to_info(self, paper: 'arxiv.Result', doi: str) -> dict:
         authors = []
         for author in paper.authors:
             authors.append({
@@ -102,19 +226,30 @@ class NotionPropMaker:
 
     def _fetch_info_from_doi(self, doi: str) -> dict:
         doi = doi.replace('//', '/')
-        works = Works()
-        info = works.doi(doi)
-
-        if info is None:
+        return self.cache.fetch('crossref', doi, self._request_crossref)
+
+    def _request_crossref(self, doi: str) -> dict:
+        with profiler.stage('crossref') as measure:
+            response = requests.get(
+                f'{CROSSREF_API}/works/{quote(doi, safe="/")}',
+                timeout=CROSSREF_TIMEOUT)
+            measure.count_bytes(response.content)
+        if response.status_code == 404:
             raise Exception(f'Extracted DOI ({doi}) was not found.')
-        return works.doi(doi)
+        response.raise_for_status()
+        return response.json()['message']
 
     def _fetch_info_from_doi_jalc(self, doi: str) -> dict:
-        url = f"https://api.japanlinkcenter.org/dois/{doi}"
+        return self.cache.fetch('jalc', doi, self._request_jalc)
+
+    def _request_jalc(self, doi: str) -> dict:
+        url = f"{JALC_API}/dois/{doi}"
         headers = {"Accept": "application/json"}
 
         try:
-            response = requests.get(url, headers=headers)
+            with profiler.stage('jalc') as measure:
+                response = requests.get(url, headers=headers)
+                measure.count_bytes(response.content)
             response.raise_for_status()  # HTTPエラーを例外にする
         except requests.exceptions.HTTPError as e:
             raise Exception(f"JaLC API HTTP error for DOI '{doi}': {e}")
@@ -286,7 +421,8 @@ class NotionPropMaker:
 
         return {k: v for k, v in info.items() if v is not None}
 
-    def _make_citekey(self, lastname, title, year):
+    @staticmethod
+    def _make_citekey(lastname, title, year):
         # from [extensions.zotero.translators.better-bibtex.skipWords], zotero.
         def convert_lastname(lastname):
             lastname = lastname.replace('_', '')
@@ -305,21 +441,20 @@ class NotionPropMaker:
             title = ' ' + unidecode(title) + ' '
             for key in ['\'s', '\'t', '\'S', '\'T']:
                 title = title.replace(key, '')
-            title = title.translate(str.maketrans('', '', string.punctuation))
-            for key in SKIPWORDS:
-                key = ' ' + key + ' '
-                title = title.replace(key, ' ')
-                title = title.replace(key.upper(), ' ').replace(up(key), ' ')
-            return title
+            return title.translate(PUNCTUATION_TABLE).split(' ')
 
         def make_shorttitle(title, n_title=3):
-            while True:
-                len_before = len(title.replace(' ', ''))
-                title = simplify(title)
-                if len_before == len(title.replace(' ', '')):
-                    break
-
-            title = [up(t) for t in title.split(' ') if t]
+            # Only the first pass can change the title except skip words.
+            len_before = len(title.replace(' ', ''))
+            words = _remove_skipwords(simplify(title))
+            if len_before != len(''.join(words)):
+                while True:
+                    n_words = len(words)
+                    words = _remove_skipwords(words)
+                    if n_words == len(words):
+                        break
+
+            title = [up(t) for t in words if t]
             if len(title) < n_title:
                 return ''.join(title)
             return ''.join(title[:n_title])
@@ -381,3 +516,44 @@ class NotionPropMaker:
                               f': {"; ".join(extra_authors)}')
             authors_ = authors_[:MAX_N_NOTION_MULTISELECT - 1] + [authors_[-1]]
         return authors_
+
+
+def citekey_from_notionprop(properties: dict, propnames: dict
+                            ) -> Optional[str]:
+    """
+    Citekey made from author, title and year of a record as
+    NotionPropMaker makes. None if any of them is empty.
+    """
+    authors = properties[propnames['author']]['multi_select']
+    title = properties[propnames['title']]['rich_text']
+    year = properties[propnames['year']]['number']
+    if not authors or not title or year is None:
+        return None
+    lastname = authors[0]['name'].split(' ')[-1]
+    title = ''.join(text['plain_text'] for text in title)
+    return NotionPropMaker._make_citekey(lastname, title, int(year))
+
+
+def _suffix(n: int) -> str:
+    """'', 'a', 'b', ..., 'z', 'aa', 'ab', ... for n = 0, 1, 2, ..."""
+    suffix = ''
+    while n > 0:
+        n, i = divmod(n - 1, 26)
+        suffix = string.ascii_lowercase[i] + suffix
+    return suffix
+
+
+class CitekeyIndex:
+    def __init__(self, citekeys: Optional[List[str]]=None):
+        """Citekeys in use, to make a new citekey unique by suffix."""
+        self.citekeys = set(citekeys or [])
+        self._n_used: Dict[str, int] = {}
+
+    def add(self, citekey: str) -> str:
+        """Register citekey with suffix (a, b, c, ...) if it is in use."""
+        n = self._n_used.get(citekey, 0)
+        while (unique := citekey + _suffix(n)) in self.citekeys:
+            n += 1
+        self._n_used[citekey] = n + 1
+        self.citekeys.add(unique)
+        return unique
@@ -1,15 +1,215 @@
+import re
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, Iterator, List, Optional
 
-from pdf2doi import pdf2doi
+import pdf2doi.finders
+import pymupdf
+from pdf2doi import pdf2doi as _pdf2doi
 
+from .notionprop import NotionPropMaker
+from .profiler import profiler
 
-def pdf_to_doi(path_pdf: Path | str) -> Optional[str]:
+DOI_PATTERN = re.compile(r'\b10\.\d{4,9}/[^\s"<>]+', re.I)
+ARXIV_PATTERN = re.compile(r'\barXiv:\s?(\d{4}\.\d{4,5})(v\d+)?', re.I)
+METADATA_KEYS = ('subject', 'keywords', 'title')
+
+# PyMuPDF must not be used from several threads at once. An extraction
+# which timed out keeps running and may hold the lock, so the others wait
+# for it only shortly and then fail, instead of running out their timeout.
+PYMUPDF_LOCK_TIMEOUT = 2.
+_pymupdf_lock = threading.Lock()
+
+
+@contextmanager
+def _pymupdf_locked() -> Iterator[None]:
+    if not _pymupdf_lock.acquire(timeout=PYMUPDF_LOCK_TIMEOUT):
+        raise TimeoutError('PyMuPDF is held by an extraction which timed out')
+    try:
+        yield
+    finally:
+        _pymupdf_lock.release()
+
+
+# pdf2doi also reads the title of PDF by PyMuPDF, so it takes the lock too.
+_find_title_via_pymupdf = pdf2doi.finders.find_title_via_pymupdf
+
+
+def _find_title_via_pymupdf_locked(file):
+    with _pymupdf_locked():
+        return _find_title_via_pymupdf(file)
+
+
+pdf2doi.finders.find_title_via_pymupdf = _find_title_via_pymupdf_locked
+
+
+def _search_doi(text: str) -> Optional[str]:
+    """First DOI in text, without punctuation which follows it."""
+    if (match := DOI_PATTERN.search(text)) is None:
+        return None
+    doi = match.group(0).rstrip('.,;:')
+    while doi.endswith((')', ']')) and \
+            doi.count(doi[-1]) > doi.count({')': '(', ']': '['}[doi[-1]]):
+        doi = doi[:-1]
+    return doi
+
+
+def doi_from_metadata(path_pdf: Path | str) -> Optional[str]:
+    """DOI in document information or XMP metadata (prism:doi etc.)."""
+    with _pymupdf_locked(), pymupdf.open(path_pdf) as doc:
+        texts = [doc.metadata.get(key) or '' for key in METADATA_KEYS]
+        texts.append(doc.get_xml_metadata())
+    for text in texts:
+        if doi := _search_doi(text):
+            return doi
+
+
+def doi_from_first_pages(path_pdf: Path | str, n_pages: int=1
+                         ) -> Optional[str]:
+    """
+    DOI or arXiv ID printed on the first pages. Publishers print DOI of the
+    paper on its first page, and later pages may contain DOIs of references.
+    """
+    with _pymupdf_locked(), pymupdf.open(path_pdf) as doc:
+        for page in doc.pages(0, min(n_pages, doc.page_count)):
+            text = page.get_text()
+            if doi := _search_doi(text):
+                return doi
+            if match := ARXIV_PATTERN.search(text):
+                return f'10.48550/arXiv.{match.group(1)}'
+
+
+def doi_from_pdf2doi(path_pdf: Path | str) -> Optional[str]:
+    """pdf2doi package, which also searches the web by title of PDF."""
     try:
-        return pdf2doi(str(path_pdf))['identifier']
+        return _pdf2doi(str(path_pdf))['identifier']
     except TypeError:
         return None
 
 
+def doi_is_found(doi: str) -> bool:
+    """
+    DOI has information in Crossref or arXiv. The information is cached,
+    so the record is made from it without another request.
+    """
+    try:
+        NotionPropMaker().info_from_doi(doi)
+    except Exception as e:
+        print(f'DOI was not validated: {doi} ({e})')
+        return False
+    return True
+
+
+@dataclass
+class ExtractorStats:
+    n_calls: int=0
+    n_hits: int=0
+    n_timeouts: int=0
+    n_errors: int=0
+    n_rejected: int=0
+    seconds: float=0.
+
+    @property
+    def hit_rate(self) -> float:
+        return self.n_hits / self.n_calls if self.n_calls else 0.
+
+    @property
+    def mean_seconds(self) -> float:
+        return self.seconds / self.n_calls if self.n_calls else 0.
+
+
+class DOIExtractor:
+    def __init__(self, name: str, func: Callable[[Path | str], Optional[str]],
+                 timeout: float,
+                 validate: Optional[Callable[[str], bool]]=None):
+        """
+        Extract DOI by func in timeout seconds. func is left running in a
+        daemon thread if it does not finish in time. DOI for which validate
+        returns False is rejected, so that the next extractor is tried.
+        """
+        self.name = name
+        self.func = func
+        self.timeout = timeout
+        self.validate = validate
+        self.stats = ExtractorStats()
+        self._lock = threading.Lock()
+
+    def __call__(self, path_pdf: Path | str) -> Optional[str]:
+        result = {}
+        def target():
+            try:
+                result['doi'] = self.func(path_pdf)
+            except Exception as e:
+                result['error'] = e
+
+        start = time.perf_counter()
+        with profiler.stage(f'doi.{self.name}'):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            thread.join(self.timeout)
+        seconds = time.perf_counter() - start
+        doi = result.get('doi')
+        is_rejected = (doi is not None and self.validate is not None
+                       and not self.validate(doi))
+        if is_rejected:
+            doi = None
+        with self._lock:
+            self.stats.n_calls += 1
+            self.stats.n_hits += doi is not None
+            self.stats.n_timeouts += thread.is_alive()
+            self.stats.n_errors += 'error' in result
+            self.stats.n_rejected += is_rejected
+            self.stats.seconds += seconds
+        if thread.is_alive():
+            print(f'{self.name}: timed out after {self.timeout} sec '
+                  f'({Path(path_pdf).name})')
+        elif 'error' in result:
+            print(f'{self.name}: {result["error"]} ({Path(path_pdf).name})')
+        return doi
+
+
+# Cheap extractors first; pdf2doi reads the whole file and queries the web.
+# The cheap ones take the first DOI-like text, which may be of a reference
+# or broken, so it is validated as pdf2doi does.
+EXTRACTORS: List[DOIExtractor] = [
+    DOIExtractor('metadata', doi_from_metadata, timeout=5.,
+                 validate=doi_is_found),
+    DOIExtractor('first page', doi_from_first_pages, timeout=10.,
+                 validate=doi_is_found),
+    DOIExtractor('pdf2doi', doi_from_pdf2doi, timeout=120.)]
+
+
+def pdf_to_doi(path_pdf: Path | str,
+               extractors: Optional[List[DOIExtractor]]=None) -> Optional[str]:
+    for extractor in (extractors or EXTRACTORS):
+        if (doi := extractor(path_pdf)) is not None:
+            return doi
+    return None
+
+
+def extractor_stats(extractors: Optional[List[DOIExtractor]]=None
+                    ) -> Dict[str, ExtractorStats]:
+    return {extractor.name: extractor.stats
+            for extractor in (extractors or EXTRACTORS)}
+
+
+def print_extractor_stats(extractors: Optional[List[DOIExtractor]]=None):
+    stats = {name: stats_ for name, stats_ in
+             extractor_stats(extractors).items() if stats_.n_calls}
+    if not stats:
+        return
+    print(f'{"DOI extractor":<16}{"calls":>7}{"hits":>7}{"hit rate":>10}'
+          f'{"mean [s]":>10}{"timeouts":>10}{"errors":>8}{"rejected":>10}')
+    for name, stats_ in stats.items():
+        print(f'{name:<16}{stats_.n_calls:>7}{stats_.n_hits:>7}'
+              f'{stats_.hit_rate:>10.1%}{stats_.mean_seconds:>10.3f}'
+              f'{stats_.n_timeouts:>10}{stats_.n_errors:>8}'
+              f'{stats_.n_rejected:>10}')
+
+
 if __name__ == '__main__':
     print(pdf_to_doi('samplepdfs/sample3.pdf'))
+    print_extractor_stats()
@@ -1,58 +1,114 @@
+import inspect
+import queue
 import re
-from copy import deepcopy
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
 from pathlib import Path
 from time import sleep
-from typing import List
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+from urllib.parse import quote
 
-from bs4 import BeautifulSoup
-from bs4.element import Tag
 from grobid_client.grobid_client import GrobidClient
+from lxml import etree
 
 from .misc import load_config
+from .profiler import profiler
 
 TEIURL = r'http://www.tei-c.org/ns/1.0'
+XMLURL = r'http://www.w3.org/XML/1998/namespace'
+TEI = '{' + TEIURL + '}'
+XMLID = '{' + XMLURL + '}id'
+XMLESCAPE = str.maketrans({'&': '&amp;', '<': '&lt;', '>': '&gt;'})
+# Newer grobid-client renamed generateIDs of process_pdf to generate_ids.
+GENERATE_IDS = ('generate_ids' if 'generate_ids' in inspect.signature(
+    GrobidClient.process_pdf).parameters else 'generateIDs')
+_DONE = object()
 
 class FigTabInfo:
     def __init__(self, arr: List):
         """tag, head, desc"""
         self.arr = arr
 
-    def add_ids_insert(self, ids_insert: List[int]):
-        self.arr = [[idx_insert] + col
-                    for idx_insert, col in zip(ids_insert, self.arr)]
-        return self
 
-    def get_tags(self):
-        if len(self.arr) == 0:
-            return None
-        for tag in list(zip(*self.arr[0])):
-            yield tag
+def _name(element: etree._Element) -> str:
+    qname = etree.QName(element)
+    if element.prefix:
+        return f'{element.prefix}:{qname.localname}'
+    return qname.localname
 
-    def descend_by_indices(self):
-        return sorted(self.arr, key=lambda x: x[0], reverse=True)
 
+def _get_text(element: etree._Element) -> str:
+    return ''.join(element.itertext())
 
-def _change_tag(soup, tag, new_tag_name: str):
-    # https://www.lifewithpython.com/2020/07/python-processing-html-bs4.html
-    new_tag = soup.new_tag(new_tag_name)
-    new_tag.attrs = tag.attrs.copy()
-    tag.wrap(new_tag)
-    tag.unwrap()
-    return new_tag
+
+def _find(element: etree._Element, tag: str) -> Optional[etree._Element]:
+    """First descendant named tag, in TEI namespace or no namespace."""
+    return next(element.iterdescendants(TEI + tag, tag), None)
+
+
+def _find_all(element: etree._Element, tag: str) -> List[etree._Element]:
+    return list(element.iterdescendants(TEI + tag, tag))
+
+
+def _parse_fragment(text: str) -> etree._Element:
+    # Fed by chunks like BeautifulSoup, which recovers broken markup
+    # differently from parsing at once.
+    CHUNKSIZE = 512
+    parser = etree.XMLParser(recover=True, strip_cdata=False)
+    for i in range(0, max(len(text), 1), CHUNKSIZE):
+        parser.feed(text[i:i + CHUNKSIZE])
+    return parser.close()
+
+
+def _quote(value: str) -> str:
+    value = value.translate(XMLESCAPE)
+    if '"' not in value:
+        return f'"{value}"'
+    if "'" not in value:
+        return f"'{value}'"
+    return '"' + value.replace('"', '&quot;') + '"'
+
+
+def _attrname(element: etree._Element, key: str) -> str:
+    if not key.startswith('{'):
+        return key
+    qname = etree.QName(key)
+    if qname.namespace == XMLURL:
+        return f'xml:{qname.localname}'
+    for prefix, url in element.nsmap.items():
+        if prefix and url == qname.namespace:
+            return f'{prefix}:{qname.localname}'
+    return qname.localname
+
+
+def _attrs_string(element: etree._Element, attrib: Dict[str, str]) -> str:
+    attrs = sorted((_attrname(element, key), value)
+                   for key, value in attrib.items())
+    return ''.join(f' {key}={_quote(value)}' for key, value in attrs)
+
+
+def _is_empty(element: etree._Element) -> bool:
+    return (not element.text) and len(element) == 0
+
+
+def _start_tag(element: etree._Element) -> str:
+    attrs = _attrs_string(element, element.attrib)
+    return f'<{_name(element)}{attrs}{"/>" if _is_empty(element) else ">"}'
 
 
 def _extr_xmltext(client: GrobidClient, i_path: str) -> str:
     # url = 'https://kermitt2-grobid.hf.space'  # DEMO URL provided by GROBID
-    CFG = dict(
-        generateIDs=False,
+    CFG = {GENERATE_IDS: False} | dict(
         consolidate_header=False,
         consolidate_citations=False,
         include_raw_citations=False,
         include_raw_affiliations=False,
         tei_coordinates=False,
         segment_sentences=False)
-    _, _, text = client.process_pdf(
-        'processFulltextDocument', str(i_path), **CFG)
+    _, _, text = client.process_pdf('processFulltextDocument',
+                                    str(i_path), **CFG)
     if text.startswith('[GENERAL] Could not create temprorary file'):
         raise RuntimeError('Check permission: ' + text)
     return text
@@ -79,56 +135,78 @@ def _make_heading_block(text: str, level: int) -> dict:
             'rich_text': [{'type': 'text', 'text': {'content': text}}]}}
 
 
-def _extr_bib(soup: BeautifulSoup) -> dict:
-    def extr_doi(bib: Tag) -> str:
-        doi = bib.find('idno', {'type': 'DOI'})
-        if doi is None:
-            return ''
-        return f'https://doi.org/{doi.get_text()}'
-
-    bibs = soup.find_all('biblStruct', {'xml:id': True})
-    return {bib['xml:id']: extr_doi(bib) for bib in bibs}
+class TEIParts:
+    def __init__(self, xmltext: str):
+        """
+        Collect what is converted to blocks by one traversal of TEI:
+        links to bibliography, figures, tables, and head/p elements in
+        sections (div declaring TEI namespace).
+        """
+        self.biblinks = {}
+        self.figures = []
+        self.tables = []
+        elements_by_div = []
+        open_divs = []
+        declares_tei = False
+        source = BytesIO(xmltext.encode('utf-8'))
+        for event, item in etree.iterparse(
+                source, events=('start-ns', 'start', 'end'), recover=True):
+            if event == 'start-ns':
+                declares_tei |= item == ('', TEIURL)
+                continue
+            element = item
+            if event == 'start':
+                if element.tag in (TEI + 'head', TEI + 'p'):
+                    for _, elements in open_divs:
+                        elements.append(element)
+                elif (element.tag == TEI + 'div') and declares_tei:
+                    elements_by_div.append([])
+                    open_divs.append((element, elements_by_div[-1]))
+                elif element.tag == TEI + 'figure':
+                    match element.get('type'):
+                        case None:
+                            self.figures.append(element)
+                        case 'table':
+                            self.tables.append(element)
+                declares_tei = False
+                continue
+            if open_divs and (open_divs[-1][0] is element):
+                open_divs.pop()
+            elif (element.tag == TEI + 'biblStruct') and (XMLID in element.attrib):
+                self.biblinks[element.get(XMLID)] = _extr_doi(element)
+        self.elements = [element for elements in elements_by_div
+                         for element in elements]
 
 
-def _extr_elements(soup: Tag):
-    bodyset = soup.find_all('div', {'xmlns': TEIURL})
-    elements = []
-    for bodies in bodyset:
-        for body in bodies.find_all(['head', 'p']):
-            elements.append(body)
-    return elements
+def _extr_doi(bib: etree._Element) -> str:
+    doi = next((idno for idno in _find_all(bib, 'idno')
+                if idno.get('type') == 'DOI'), None)
+    if doi is None:
+        return ''
+    # e.g. SICI DOIs have '<' and '>', which are not valid in URL
+    return f'https://doi.org/{quote(_get_text(doi), safe="/:;()")}'
 
 
-def _extr_figtab_info(figtabs: Tag) -> FigTabInfo:
+def _extr_figtab_info(figtabs: List[etree._Element]) -> FigTabInfo:
     fig_info = []
     for figtab in figtabs:
-        tag = figtab['xml:id']
-        head = figtab.find('head').get_text()
-        desc = figtab.find('figDesc').get_text()
+        tag = figtab.attrib[XMLID]
+        head = _get_text(_find(figtab, 'head'))
+        desc = _get_text(_find(figtab, 'figDesc'))
         if desc.startswith(head):
             desc = desc[len(head):]
         fig_info.append([tag, head, desc])
     return FigTabInfo(fig_info)
 
 
-def _extr_fig_info(soup: BeautifulSoup) -> FigTabInfo:
-    figures = soup.find_all('figure', {'type': False})
-    return _extr_figtab_info(figures)
-
-
-def _extr_tab_info(soup: BeautifulSoup) -> FigTabInfo:
-    tables = soup.find_all('figure', {'type': 'table'})
-    return _extr_figtab_info(tables)
-
-
-def _extr_table(soup: BeautifulSoup) -> dict:
-    def tabletag2block(tabletag: Tag) -> str:
-        def tabletag2strlist(table: Tag):
-            rows = table.find_all('row')
+def _extr_table(tables: List[etree._Element]) -> dict:
+    def tabletag2block(tabletag: etree._Element) -> str:
+        def tabletag2strlist(table: etree._Element):
+            rows = _find_all(table, 'row')
             strlist = []
             for row in rows:
                 strlist.append(
-                    [cell.get_text() for cell in row.find_all('cell')])
+                    [_get_text(cell) for cell in _find_all(row, 'cell')])
             return strlist
 
         def table2block(table) -> dict:
@@ -148,87 +226,117 @@ def _extr_table(soup: BeautifulSoup) -> dict:
         tabletag = tabletag2strlist(tabletag)
         return table2block(tabletag)
 
-    tables = soup.find_all('figure', {'type': 'table'})
     blocks = dict()
     for table in tables:
-        table_id = table['xml:id']
-        table = table.find('table')
+        table_id = table.attrib[XMLID]
+        table = _find(table, 'table')
         blocks[table_id] = tabletag2block(table)
     return blocks
 
 
-def _find_ids_insert(elements: List[BeautifulSoup], info: FigTabInfo
-                     ) -> List[int]:
-    ids_insert = []
-    for tag in info.get_tags():
-        for idx_insert, element in enumerate(elements):
-            if element.find('ref', {'target': f'#{tag}'}):
-                break
-        ids_insert.append(idx_insert + 1)
-    return ids_insert
-
-
-def _insert_figtab(elements: List[BeautifulSoup], info: FigTabInfo
-                   ) -> List[dict]:
-    info = deepcopy(info)
-    info.add_ids_insert(_find_ids_insert(elements, info)).descend_by_indices()
-    for idx_insert, _, head, desc in info.arr:
-        to_insert = BeautifulSoup(f'<p>{head} {desc}</p>', 'xml').find('p')
-        elements.insert(idx_insert, to_insert)
-
-
-def _insert_fig(elements: List[BeautifulSoup], fig_info: FigTabInfo
-                ) -> List[dict]:
-    return _insert_figtab(elements, fig_info)
-
-
-def _insert_tab(elements: List[BeautifulSoup], info: FigTabInfo,
-                tables: dict) -> List[dict]:
-    _insert_figtab(elements, info)
-    info = deepcopy(info)
-    info.add_ids_insert(_find_ids_insert(elements, info)).descend_by_indices()
-    for idx_insert, tag, _, _ in info.arr:
-        elements.insert(idx_insert, tables[tag])
-
-
-def _elements2children_biblink(elements: List, biblinks) -> List:
-    def replace_biblink(element: Tag) -> BeautifulSoup:
-        text = str(element)
-        for key, link in biblinks.items():
-            text = text.replace(f'<ref target="#{key}" type="bibr">',
-                                f'<ref target="{link}" type="bibr">')
-        element = BeautifulSoup(text, 'xml').find(element.name)
-        for empty_link_tag in element.find_all('ref', {'target': ''}):
-            empty_link_tag.unwrap()
-        return element
-
-    def split_texts_by_biblink(element: Tag) -> List[str] | None:
-        if len(bibrefs := element.find_all('ref', {'type': 'bibr'})) == 0:
-            return
-        for bibref in bibrefs:
-            _change_tag(element.parent, bibref, 'bibref')
-        texts = re.split(r'<bibref |</bibref>', str(element))
-        texts = [re.sub(r'<p>|</p>', '', text) for text in texts]
-        return texts
+def _index_ref_targets(elements: List[etree._Element]) -> Dict[str, int]:
+    """Index of the first element referring to each target like '#fig_0'."""
+    index = {}
+    for idx, element in enumerate(elements):
+        for ref in _find_all(element, 'ref'):
+            index.setdefault(ref.get('target'), idx)
+    return index
+
+
+def _insert_figtab(elements: List[etree._Element], fig_info: FigTabInfo,
+                   tab_info: FigTabInfo, tables: dict) -> List:
+    """
+    Insert captions of figures, and tables followed by their captions,
+    next to the first element referring to them. Unreferred ones go to the
+    end.
+    """
+    def make_caption(head: str, desc: str) -> etree._Element:
+        return _parse_fragment(f'<p>{head} {desc}</p>')
+
+    targets = _index_ref_targets(elements)
+    to_insert = defaultdict(list)
+    for tag, head, desc in fig_info.arr:
+        idx = targets.get(f'#{tag}', len(elements))
+        to_insert[idx].append(make_caption(head, desc))
+    for tag, head, desc in tab_info.arr:
+        idx = targets.get(f'#{tag}', len(elements))
+        to_insert[idx] += [tables[tag], make_caption(head, desc)]
+
+    inserted = []
+    for idx, element in enumerate(elements):
+        inserted.append(element)
+        inserted += to_insert[idx]
+    return inserted + to_insert[len(elements)]
+
+
+def _biblink(ref: etree._Element, biblinks: Dict[str, str]) -> str:
+    """DOI link of the bibliography <ref type="bibr"> refers to, or ''."""
+    target = ref.get('target') or ''
+    if not target.startswith('#') or _is_empty(ref):
+        return ''
+    return biblinks.get(target[1:], '')
+
+
+def _split_rich_text_by_biblink(element: etree._Element,
+                                biblinks: Dict[str, str]) -> List[dict] | None:
+    """
+    Rich text of element, split at the bibliography references, which are
+    linked to DOI of the reference. Other markup is kept in the text as the
+    former implementation did. References without DOI are left as text.
+    None if no reference is linked.
+    """
+    if not any(_biblink(ref, biblinks) for ref in _find_all(element, 'ref')
+               if ref.get('type') == 'bibr'):
+        return
+
+    rich_text, pieces = [], []
+
+    def add_text(link: str | None=None):
+        text = {'content': ''.join(pieces)}
+        if link is not None:
+            text['link'] = {'url': link}
+        rich_text.append({'text': text})
+        pieces.clear()
+
+    def walk(parent: etree._Element):
+        for child in parent:
+            if not isinstance(child.tag, str):
+                if child.tag is etree.Comment:
+                    pieces.append(f'<!--{child.text}-->')
+            elif _name(child) == 'ref' and (
+                    child.get('type') == 'bibr' or child.get('target') == ''):
+                link = _biblink(child, biblinks)
+                if link:
+                    add_text()
+                pieces.append((child.text or '').translate(XMLESCAPE))
+                walk(child)
+                if link:
+                    add_text(link)
+            else:
+                pieces.append(_start_tag(child))
+                if not _is_empty(child):
+                    pieces.append((child.text or '').translate(XMLESCAPE))
+                    walk(child)
+                    pieces.append(f'</{_name(child)}>')
+            pieces.append((child.tail or '').translate(XMLESCAPE))
+
+    pieces.append((element.text or '').translate(XMLESCAPE))
+    walk(element)
+    add_text()
+    return rich_text
 
+
+def _elements2children_biblink(elements: List, biblinks: Dict[str, str]
+                               ) -> List:
     replaced = []
     for element in elements:
         if isinstance(element, dict):
             replaced.append(element)
             continue
-        element = replace_biblink(element)
-        texts = split_texts_by_biblink(element)
-        if texts is None:
+        rich_text = _split_rich_text_by_biblink(element, biblinks)
+        if rich_text is None:
             replaced.append(element)
             continue
-        pattern = r'target="(.*?)" type="bibr">'
-        rich_text = []
-        for text in texts:
-            if (match := re.search(pattern, text)) is None:
-                rich_text.append({'text': {'content': text}})
-                continue
-            rich_text.append({'text': {'content': re.sub(pattern, '', text),
-                                       'link': {'url': match.group(1)}}})
         replaced.append(_make_paragraph_block(rich_text))
     return replaced
 
@@ -236,10 +344,10 @@ def _elements2children_biblink(elements: List, biblinks) -> List:
 def _elements2children_heading(elements) -> List:
     children = []
     for element in elements:
-        if isinstance(element, dict) or (element.name != 'head'):
+        if isinstance(element, dict) or (_name(element) != 'head'):
             children.append(element)
             continue
-        children.append(_make_heading_block(element.get_text(), 1))
+        children.append(_make_heading_block(_get_text(element), 1))
     return children
 
 
@@ -265,49 +373,117 @@ def _elements2children_paragraph(elements: List) -> List[dict]:
         if isinstance(element, dict):
             children.append(element)
             continue
-        texts = split_text(element.get_text())
+        texts = split_text(_get_text(element))
         for text in texts:
             rich_text = _make_simple_rich_text(text)
             children.append(_make_paragraph_block(rich_text))
     return children
 
 
-def pdf2children(client: GrobidClient, i_path: str | Path) -> str | None:
-    soup = BeautifulSoup(_extr_xmltext(client, i_path), 'xml')
-
-    biblinks = _extr_bib(soup)
-    fig_info = _extr_fig_info(soup)
-    tab_info = _extr_tab_info(soup)
-    tables = _extr_table(soup)
-
-    elements = _extr_elements(soup)
+def tei2children(xmltext: str) -> List[dict]:
+    parts = TEIParts(xmltext)
+    fig_info = _extr_figtab_info(parts.figures)
+    tab_info = _extr_figtab_info(parts.tables)
+    tables = _extr_table(parts.tables)
 
-    _insert_fig(elements, fig_info)
-    _insert_tab(elements, tab_info, tables)
-    elements = _elements2children_biblink(elements, biblinks)
+    elements = parts.elements
+    elements = _insert_figtab(elements, fig_info, tab_info, tables)
+    elements = _elements2children_biblink(elements, parts.biblinks)
     elements = _elements2children_heading(elements)
     children = _elements2children_paragraph(elements)
     return children
 
 
+def pdf2children(client: GrobidClient, i_path: str | Path) -> str | None:
+    return tei2children(_extr_xmltext(client, i_path))
+
+
 class PDF2ChildrenConverter:
-    def __init__(self, url: str):
+    def __init__(self, url: str, n_tries: int=5, interval: float=1.):
+        """Connect to GROBID at url. Keep url empty not to extract text."""
         if url == '':
             self.client = None
             return
-        while True:
+        for i_try in range(n_tries):
             try:
                 self.client = GrobidClient(url)
-            except:
-                print('Failed to connect to GORBID, retry...')
-                sleep(1.)
-                continue
-            break
+                return
+            except Exception as e:
+                error = e
+                print(f'Failed to connect to GROBID ({i_try + 1}/{n_tries})')
+                if i_try + 1 < n_tries:
+                    sleep(interval)
+        raise ConnectionError(f'GROBID is not available at {url}') from error
 
     def convert(self, i_path_pdf: str | Path):
-        if self.client:
-            return pdf2children(self.client, i_path_pdf)
-
+        if not self.client:
+            return
+        with profiler.stage('grobid') as measure:
+            measure.add_bytes(Path(i_path_pdf).stat().st_size)
+            xmltext = _extr_xmltext(self.client, i_path_pdf)
+        with profiler.stage('tei2children') as measure:
+            measure.count_bytes(xmltext)
+            return tei2children(xmltext)
+
+    def convert_many(self, i_paths_pdf: Iterable[str | Path], n_parallel: int=4
+                     ) -> Iterator[Tuple[str | Path, Optional[List],
+                                         Optional[Exception]]]:
+        """
+        Send up to n_parallel PDFs to GROBID at once and yield
+        (path, children, error) as each conversion finishes.
+        A failed conversion is yielded with its error and does not stop
+        the others. i_paths_pdf can be a generator which yields paths
+        one by one; it is consumed in another thread only as far as free
+        slots allow, so finished conversions are not kept waiting for it.
+        It is closed when this generator is closed.
+        """
+        i_paths_pdf = iter(i_paths_pdf)
+        # A slot is taken by each PDF from its submission until its result
+        # is yielded, so results which are not yet taken are also bounded.
+        slots = threading.Semaphore(n_parallel)
+        finished = queue.Queue()
+        stop = threading.Event()
+        errors = []
+        executor = ThreadPoolExecutor(max_workers=n_parallel)
+
+        def feed():
+            try:
+                while True:
+                    slots.acquire()
+                    if stop.is_set():
+                        break
+                    try:
+                        i_path_pdf = next(i_paths_pdf)
+                    except StopIteration:
+                        break
+                    future = executor.submit(self.convert, i_path_pdf)
+                    future.add_done_callback(
+                        lambda future, i_path_pdf=i_path_pdf:
+                            finished.put((i_path_pdf, future)))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                if hasattr(i_paths_pdf, 'close'):
+                    i_paths_pdf.close()
+                executor.shutdown(wait=True)
+                finished.put(_DONE)
+
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        try:
+            while (item := finished.get()) is not _DONE:
+                i_path_pdf, future = item
+                slots.release()
+                error = future.exception()
+                children = None if error else future.result()
+                yield i_path_pdf, children, error
+            if errors:
+                raise errors[0]
+        finally:
+            stop.set()
+            slots.release()
+            executor.shutdown(wait=False, cancel_futures=True)
+            feeder.join()
 
 if __name__ == '__main__':
     from .database import Database, DatabaseInfo
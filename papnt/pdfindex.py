@@ -0,0 +1,52 @@
+import hashlib
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+CHUNKSIZE = 1 << 20
+
+
+def sha256_of_file(path: str | Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while chunk := f.read(CHUNKSIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class PDFIndex:
+    def __init__(self, path_db: str | Path, database_id: str):
+        """
+        Content hash (SHA-256) of PDFs already recorded in the database,
+        with the ID of created page, the extracted DOI and whether the text
+        by GROBID was added to the page.
+        """
+        Path(path_db).parent.mkdir(parents=True, exist_ok=True)
+        self.database_id = database_id
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path_db), check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS pdfs ('
+                'database_id TEXT, sha256 TEXT, page_id TEXT, doi TEXT, '
+                'is_text_added INTEGER, PRIMARY KEY (database_id, sha256))')
+
+    def get(self, sha256: str) -> Optional[Tuple[str, str, bool]]:
+        """Return (page ID, DOI, is_text_added) if the PDF was recorded."""
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT page_id, doi, is_text_added FROM pdfs '
+                'WHERE database_id = ? AND sha256 = ?',
+                (self.database_id, sha256)).fetchone()
+        if row is None:
+            return None
+        page_id, doi, is_text_added = row
+        return page_id, doi, bool(is_text_added)
+
+    def add(self, sha256: str, page_id: str, doi: Optional[str],
+            is_text_added: bool=False):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO pdfs VALUES (?, ?, ?, ?, ?)',
+                (self.database_id, sha256, page_id, doi, is_text_added))
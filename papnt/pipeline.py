@@ -0,0 +1,99 @@
+import queue
+import threading
+import traceback
+from typing import Any, Callable, Iterable, Iterator, List, Optional
+
+_DONE = object()
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[Any], Optional[Any]],
+                 n_workers: int=1,
+                 on_error: Optional[Callable[[Any, Exception], None]]=None):
+        """
+        func: Callable
+            Receives an item from the previous stage and returns the item
+            passed to the next stage. Return None to drop the item.
+        on_error: Callable
+            Receives the item and the exception when func raises, e.g. to
+            log the failure. The item is dropped either way, and traceback
+            is printed if on_error is None.
+        """
+        self.name = name
+        self.func = func
+        self.n_workers = max(1, int(n_workers))
+        self.on_error = on_error
+
+
+class Pipeline:
+    def __init__(self, stages: List[Stage]):
+        self.stages = stages
+
+    def _work(self, stage: Stage, inbox: queue.Queue, outbox: queue.Queue):
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                return
+            try:
+                result = stage.func(item)
+            except Exception as e:
+                if stage.on_error is None:
+                    print(f'Error in {stage.name} stage: {item}')
+                    traceback.print_exc()
+                else:
+                    stage.on_error(item, e)
+                continue
+            if result is not None:
+                outbox.put(result)
+
+    def _close_when_finished(self, workers: List[threading.Thread],
+                             outbox: queue.Queue, n_next_workers: int):
+        for worker in workers:
+            worker.join()
+        for _ in range(n_next_workers):
+            outbox.put(_DONE)
+
+    def run(self, items: Iterable) -> Iterator:
+        """
+        Yield outputs of the last stage as soon as they are produced.
+        Each stage has its own bounded worker pool, so stages overlap.
+        Order of the outputs is not guaranteed. Error in iterating items
+        is raised after the items read before it are processed.
+        """
+        queues = [queue.Queue(maxsize=stage.n_workers * 2)
+                  for stage in self.stages] + [queue.Queue()]
+        threads = []
+        for i, stage in enumerate(self.stages):
+            workers = [threading.Thread(
+                target=self._work, args=(stage, queues[i], queues[i + 1]),
+                daemon=True) for _ in range(stage.n_workers)]
+            for worker in workers:
+                worker.start()
+            n_next_workers = (self.stages[i + 1].n_workers
+                              if i + 1 < len(self.stages) else 1)
+            closer = threading.Thread(
+                target=self._close_when_finished,
+                args=(workers, queues[i + 1], n_next_workers), daemon=True)
+            closer.start()
+            threads += workers + [closer]
+
+        errors = []
+        def feed():
+            try:
+                for item in items:
+                    queues[0].put(item)
+            except Exception as e:
+                errors.append(e)
+            finally:  # Or the workers wait for items forever
+                for _ in range(self.stages[0].n_workers):
+                    queues[0].put(_DONE)
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+        while (result := queues[-1].get()) is not _DONE:
+            yield result
+        feeder.join()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
@@ -0,0 +1,96 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator
+
+
+@dataclass
+class StageStats:
+    n_calls: int=0
+    seconds: float=0.
+    n_bytes: int=0
+
+
+def _size(obj: Any) -> int:
+    if isinstance(obj, (bytes, bytearray)):
+        return len(obj)
+    if isinstance(obj, str):
+        return len(obj.encode())
+    return len(json.dumps(obj, ensure_ascii=False).encode())
+
+
+class _Measure:
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.n_bytes = 0
+
+    def add_bytes(self, n_bytes: int):
+        self.n_bytes += n_bytes
+
+    def count_bytes(self, obj: Any):
+        """Add size of bytes, text or JSON-like obj, only when profiling."""
+        if self.enabled and obj is not None:
+            self.n_bytes += _size(obj)
+
+
+class Profiler:
+    def __init__(self):
+        """
+        Time, number of calls and bytes by stage. Stages running in parallel
+        threads are summed, so the total may exceed the wall time.
+        """
+        self.enabled = False
+        self.stats: Dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def enable(self):
+        self.enabled = True
+        self._started_at = time.perf_counter()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[_Measure]:
+        measure = _Measure(self.enabled)
+        if not self.enabled:
+            yield measure
+            return
+        start = time.perf_counter()
+        try:
+            yield measure
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                stats = self.stats.setdefault(name, StageStats())
+                stats.n_calls += 1
+                stats.seconds += seconds
+                stats.n_bytes += measure.n_bytes
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            stages = {name: asdict(stats) for name, stats
+                      in sorted(self.stats.items())}
+        wall = (time.perf_counter() - self._started_at
+                if self._started_at is not None else 0.)
+        return {'wall_seconds': wall, 'stages': stages}
+
+    def summary(self) -> str:
+        profile = self.to_dict()
+        lines = [f'{"stage":<28}{"calls":>8}{"total [s]":>11}'
+                 f'{"mean [ms]":>11}{"bytes":>13}']
+        for name, stats in profile['stages'].items():
+            mean = stats['seconds'] / stats['n_calls'] * 1000
+            lines.append(f'{name:<28}{stats["n_calls"]:>8}'
+                         f'{stats["seconds"]:>11.3f}{mean:>11.1f}'
+                         f'{stats["n_bytes"]:>13,}')
+        lines.append(f'{"wall time":<28}{"":>8}'
+                     f'{profile["wall_seconds"]:>11.3f}')
+        return '\n'.join(lines)
+
+    def save(self, path_json: str | Path):
+        Path(path_json).write_text(json.dumps(self.to_dict(), indent=2))
+
+
+profiler = Profiler()
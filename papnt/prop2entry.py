@@ -1,45 +1,61 @@
+from functools import lru_cache
 from typing import List, Dict
 import re
 
+PREPOSITIONS = [
+    "da", "de", "degli", "del", "della", "des", "de la", "de las",
+    "de los", "el", "di", "du", "la", "le", "l'", "van", "van de",
+    "van den", "van der", "von", "von dem", "von der", "zu",
+    "zu der",
+]
+PREPOSITIONS_ = [prepo.replace(' ', '_') for prepo in PREPOSITIONS]
+# ' van der ' -> ' van_der ', in the order of PREPOSITIONS
+PREPOSITION_SUBS = [
+    (re.compile(r'\b' + re.escape(' ' + prepo + ' ') + r'\b'),
+     ' ' + prepo_ + ' ') for prepo, prepo_ in zip(PREPOSITIONS, PREPOSITIONS_)]
+# Names without any of them, as most names are, need none of the above.
+PREPOSITION_MATCHER = re.compile(
+    ' (?:' + '|'.join(re.escape(prepo) for prepo
+                      in sorted(set(PREPOSITIONS + PREPOSITIONS_),
+                                key=len, reverse=True)) + ') ')
+
+
+def _extr_lastname(name: str) -> str:
+    if PREPOSITION_MATCHER.search(name) is None:
+        return name.split()[-1]
+
+    for pattern, after in PREPOSITION_SUBS:
+        name = pattern.sub(after, name)
+
+    preposition = ''
+    for preposit_ in PREPOSITIONS_:
+        preposit_ = ' ' + preposit_ + ' '
+        if preposit_ in name:
+            preposition = preposit_.replace('_', ' ')[1:]  # remove head space
+    return preposition + name.split()[-1]
 
-def _extr_authors_asbib(authors: List[Dict] | None) -> str:
-    def extr_lastname(name: str):
-        PREPOSITIONS = [
-            "da", "de", "degli", "del", "della", "des", "de la", "de las",
-            "de los", "el", "di", "du", "la", "le", "l'", "van", "van de",
-            "van den", "van der", "von", "von dem", "von der", "zu",
-            "zu der", 
-        ]
-        prepositions_ = [prepo.replace(' ', '_') for prepo in PREPOSITIONS]
-
-        for preposition in PREPOSITIONS:
-            before = ' ' + preposition + ' '
-            after = ' ' + preposition.replace(' ', '_') + ' '
-            name = re.sub(r'\b' + re.escape(before) + r'\b', after, name)
-
-        preposition = ''
-        for preposit_ in prepositions_:
-            preposit_ = ' ' + preposit_ + ' '
-            match = re.search(preposit_, name)
-            if match:
-                preposition = match.group(0).replace('_', ' ')[1:]  # remove head space
-        return preposition + name.split()[-1]
 
+@lru_cache(maxsize=1 << 16)
+def _format_author(name: str) -> str:
+    lastname = _extr_lastname(name)
+    firstnames = name.replace(lastname, '').rstrip()
+    lastname = lastname.replace('_', ' ')
+    if ' ' in lastname:
+        lastname = '{' + lastname + '}'
+    if firstnames:
+        return f'{lastname}, {firstnames}'
+    return lastname
+
+
+def format_authors_asbib(names: List[str]) -> str:
+    """Author names as BibTeX author field, like 'Doe, John and ...'."""
+    return ' and '.join(map(_format_author, names))
+
+
+def _extr_authors_asbib(authors: List[Dict] | None) -> str:
     if authors is None:
         return ''
-    names = []
-    for author in authors:
-        name = author['name']
-        lastname = extr_lastname(name)
-        firstnames = name.replace(lastname, '').rstrip()
-        lastname = lastname.replace('_', ' ')
-        if ' ' in lastname:
-            lastname = '{' + lastname + '}'
-        if firstnames:
-            names.append(f'{lastname}, {firstnames}')
-        else:
-            names.append(lastname)
-    return ' and '.join(names)
+    return format_authors_asbib([author['name'] for author in authors])
 
 
 def _extr_propvalue(prop: Dict, proptype: str) -> str:
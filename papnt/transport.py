@@ -0,0 +1,101 @@
+import random
+import threading
+import time
+from typing import Any, Callable
+
+import httpx
+from notion_client.errors import RequestTimeoutError
+
+STATUS_TO_RETRY = (409, 429, 500, 502, 503, 504)
+# Requests which are not idempotent (e.g. creating a page) are retried only
+# when Notion surely did not process them, not to make duplicates.
+STATUS_TO_RETRY_UNPROCESSED = (429, 503)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        """Allow `rate` requests per second on average, `capacity` at once."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens
+                                  + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def pause(self, seconds: float):
+        """Hold every request back, e.g. while Notion asks us to slow down."""
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class NotionTransport:
+    def __init__(self, requests_per_second: float=3., max_retries: int=5,
+                 max_concurrent_requests: int=3, backoff_base: float=1.,
+                 backoff_max: float=60.):
+        """
+        Send requests to Notion within its rate limit (3 requests per second
+        on average) and retry rate-limited, failed or timed out requests
+        with jittered exponential backoff. Requests which are not idempotent
+        are retried only if they were rejected or not sent.
+        """
+        self.bucket = TokenBucket(requests_per_second, requests_per_second)
+        self.slots = threading.BoundedSemaphore(max_concurrent_requests)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def _wait_before_retry(self, n_tried: int, error: Exception) -> float:
+        retry_after = getattr(error, 'headers', {}).get('retry-after')
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+        wait = min(self.backoff_max, self.backoff_base * 2 ** n_tried)
+        return random.uniform(wait / 2, wait)
+
+    def _should_retry(self, error: Exception, idempotent: bool) -> bool:
+        if not idempotent:
+            if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout)):
+                return True
+            return getattr(error, 'status', None) in STATUS_TO_RETRY_UNPROCESSED
+        if isinstance(error, (RequestTimeoutError, httpx.TransportError)):
+            return True
+        return getattr(error, 'status', None) in STATUS_TO_RETRY
+
+    def call(self, method: Callable, idempotent: bool=True, **kwargs) -> Any:
+        """
+        idempotent: bool
+            False for requests which make something each time they are
+            processed, like creating a page or appending blocks.
+        """
+        n_tried = 0
+        while True:
+            self.bucket.acquire()
+            try:
+                with self.slots:
+                    return method(**kwargs)
+            except Exception as e:
+                if (n_tried >= self.max_retries) or \
+                        not self._should_retry(e, idempotent):
+                    raise
+                wait = self._wait_before_retry(n_tried, e)
+                print(f'Request to Notion failed ({e}), '
+                      f'retry after {wait:.1f} sec...')
+                if getattr(e, 'status', None) == 429:
+                    self.bucket.pause(wait)
+                time.sleep(wait)
+                n_tried += 1